@@ -0,0 +1,83 @@
+import heapq
+from bisect import bisect_left
+
+from drug_catalog import split_brands
+
+# Typeahead over every generic and brand name in the catalog. Names are kept in one sorted list,
+# so the names starting with a prefix are a contiguous slice found with two binary searches.
+# Suggestions are ranked by rating (best first); answers for 1-2 letter prefixes, whose slices
+# are the widest, are precomputed. No model, no vector store, no network.
+
+MAX_SUGGESTIONS = 25
+PRECOMPUTED_PREFIX_CHARS = 2
+
+
+class NameIndex:
+    def __init__(self, keys, entries, ranks):
+        self.keys = keys       # sorted lowercased names
+        self.entries = entries # suggestion dict per key
+        self.ranks = ranks     # position of each key in the by-rating order (0 = best)
+        self.top = {}          # short prefix -> best MAX_SUGGESTIONS key ids
+        for i in sorted(range(len(keys)), key=ranks.__getitem__):
+            for n in range(1, PRECOMPUTED_PREFIX_CHARS + 1):
+                if len(keys[i]) >= n:
+                    ids = self.top.setdefault(keys[i][:n], [])
+                    if len(ids) < MAX_SUGGESTIONS:
+                        ids.append(i)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, catalog):
+        names = {} # key -> [display name, type, generic name, rating]
+        for key, rows in catalog.generic_index.items():
+            names[key] = [key, "generic", key, _best_rating(catalog, rows)]
+        for key, rows in catalog.brand_index.items():
+            if key in names:
+                continue
+            best = max(rows, key=lambda i: _rating(catalog, i))
+            display = next((b for b in split_brands(catalog.brand_names[best]) if b.lower() == key), key)
+            names[key] = [display, "brand", catalog.full_name[best], _best_rating(catalog, rows)]
+
+        keys = sorted(names)
+        entries = [
+            {"name": name, "type": kind, "generic_name": generic, "rating": rating}
+            for name, kind, generic, rating in (names[key] for key in keys)
+        ]
+        # Rated before unrated, then shorter (closer to what was typed), then alphabetical
+        unrated = -1.0
+        order = sorted(range(len(keys)), key=lambda i: (
+            -(unrated if entries[i]["rating"] is None else entries[i]["rating"]), len(keys[i]), keys[i]
+        ))
+        ranks = [0] * len(keys)
+        for rank, i in enumerate(order):
+            ranks[i] = rank
+        return cls(keys, entries, ranks)
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        key = prefix.strip().lower()
+        if not key:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+
+        lo = bisect_left(self.keys, key)
+        if len(key) <= PRECOMPUTED_PREFIX_CHARS:
+            ids = self.top.get(key, [])[:limit]
+        else:
+            hi = bisect_left(self.keys, key + "\uffff", lo)
+            ids = heapq.nsmallest(limit, range(lo, hi), key=self.ranks.__getitem__)
+
+        # A name typed in full comes first, however it's rated
+        if lo < len(self.keys) and self.keys[lo] == key and lo not in ids[:1]:
+            ids = [lo, *(i for i in ids if i != lo)][:limit]
+        return [self.entries[i] for i in ids]
+
+
+def _rating(catalog, i: int) -> float:
+    rating = catalog.rating[i]
+    return -1.0 if rating != rating else rating
+
+def _best_rating(catalog, rows):
+    best = max(_rating(catalog, i) for i in rows)
+    return None if best < 0 else round(best, 1)
@@ -2,30 +2,98 @@ from typing import Optional, Union, List
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from fastapi import APIRouter, Request, FastAPI, File, Form, HTTPException, Path, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Request, FastAPI, File, Form, HTTPException, Path, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
+from pydantic import BaseModel, Field
+import asyncio
+import json
+import math
 import shutil
 import os
+import time
 import uvicorn
+from uuid import uuid4
 
 ##### Custom Libraries
-from pinecone_query import init_resources, clear_resources, retrieve_drugs, get_medication_definitions_for_gemini
-from gemini_response import generate_medication_summary
-from db import prescriptions_collection, users_collection
+from pinecone_query import (
+    init_resources, clear_resources, retrieve_drugs_bulk_async, get_medication_facts_async, check_interactions,
+    suggest_names
+)
+from autocomplete import MAX_SUGGESTIONS
+from interactions import format_for_prompt, rules_hash
+from prompt_builder import fit_medications
+from gemini_client import GeminiUnavailable
+from gemini_response import generate_medication_summary_async, stream_medication_summary, get_model, build_prompt, PROMPT_VERSION
+from db import (
+    prescriptions_collection, users_collection, summary_cache_collection, ensure_indexes, check_connection,
+    get_active_medications, get_active_medications_many, add_active_medications, rebuild_active_medications
+)
+from summary_cache import SummaryCache
+from singleflight import SingleFlight
+from jobs import JobQueue
+from ocr_parser import extract_text_from_pdf, parse_prescription
+import metrics
 
 load_dotenv()
 UPLOAD_DIR = "uploads"
+MAX_BULK_NAMES = int(os.getenv("MAX_BULK_NAMES", "500"))
+# Summaries generated at once for one /households/ request; cached ones don't count
+HOUSEHOLD_CONCURRENCY = int(os.getenv("HOUSEHOLD_CONCURRENCY", "4"))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Summaries embed the interaction flags, so a change to the rules invalidates them too
+summary_cache = SummaryCache(summary_cache_collection, f"{PROMPT_VERSION}-{rules_hash()}")
+# Identical summaries requested at the same time (same cache key) share one Gemini call, streamed or not
+summary_flights = SingleFlight("summary")
+job_queue = JobQueue()
+
+# /summaries/ has no profile to work with yet, so it summarizes against this one
+DEFAULT_PROFILE = {"age": 65, "conditions": [], "allergies": []}
+
+# Startup is split: routes are served immediately, and the model, vector store and clients
+# load in the background. /readyz reports progress; routes that need the model wait for it.
+warmup_state = {"ready": False, "stage": "starting", "error": None, "started_at": time.time(), "ready_after_s": None}
+
+async def warmup():
+    def progress(stage: str):
+        warmup_state["stage"] = stage
+
+    try:
+        await asyncio.to_thread(init_resources, progress)
+        progress("connecting_gemini")
+        await asyncio.to_thread(get_model)
+        progress("connecting_mongodb")
+        # Not ready until MongoDB answers; it may simply be starting up alongside us
+        while not await check_connection():
+            await asyncio.sleep(5)
+        await ensure_indexes()
+        await summary_cache.ensure_indexes()
+        warmup_state.update(ready=True, stage="ready", ready_after_s=round(time.time() - warmup_state["started_at"], 2))
+    except Exception as e:
+        print(f"Warmup failed: {e}")
+        warmup_state.update(stage="failed", error=str(e))
+
+def require_ready():
+    if not warmup_state["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service is warming up ({warmup_state['stage']}).",
+            headers={"Retry-After": "5"}
+        )
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_resources()
+    metrics.init_tracing()
+    warmup_task = asyncio.create_task(warmup())
+    upload_workers = job_queue.start({"upload": process_upload}, on_final={"upload": remove_upload})
     yield
+    for task in [warmup_task, *upload_workers]:
+        task.cancel()
+    await asyncio.gather(warmup_task, *upload_workers, return_exceptions=True)
     clear_resources()
+    metrics.shutdown_tracing()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -39,12 +107,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Outermost, so its timing covers the whole request
+app.add_middleware(metrics.MetricsMiddleware)
 
 # === Models ===
 class QueryRequest(BaseModel):
     query_text: str
 
+class BulkQueryRequest(BaseModel):
+    names: list[str] = Field(..., max_length=MAX_BULK_NAMES)
+
 class MedicationEntry(BaseModel):
     name: str
     definition: Optional[str] = None
@@ -68,10 +142,16 @@ class MedicationRequest(BaseModel):
 class Prescription(BaseModel):
     pres_name: str
     pres_strength: str
+    route: Optional[str] = None
+    frequency: Optional[str] = None
     refills: int
     date_prescribed: str
     active: bool
 
+class PrescriptionStatusUpdate(BaseModel):
+    pres_name: str
+    active: bool
+
 class PrescriptionDocument(BaseModel):
     user_id: str
     prescriptions: List[Prescription]
@@ -82,12 +162,171 @@ class UserData(BaseModel):
     family_members: Optional[List[str]] = []
     documents: List[PrescriptionDocument] = []
 
+def format_profile(profile: dict) -> str:
+    return (
+        f"Age: {profile['age']}\n"
+        f"Conditions: {', '.join(profile['conditions']) or 'None'}\n"
+        f"Allergies: {', '.join(profile['allergies']) or 'None'}"
+    )
+
+async def medication_section(med_names: list[str], profile_str: str, notes: str) -> str:
+    # Compact catalog facts per medication, trimmed to what's left of the prompt token budget
+    facts = await get_medication_facts_async(med_names)
+    return fit_medications(facts, build_prompt("", profile_str, notes))
+
+def gemini_unavailable(e: GeminiUnavailable) -> HTTPException:
+    # Upstream is throttling or down: tell the client when to come back instead of a bare 500
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def summary_source(cache_key: str, prepare, interactions: dict, stream: bool):
+    # The one Gemini call behind a summary flight; the result is cached before any reader sees the end
+    async def source():
+        meds_str, profile_str = await prepare()
+        notes = format_for_prompt(interactions) if interactions else ""
+        parts = []
+        reason = ""
+        if stream:
+            async for kind, payload in stream_medication_summary(meds_str, profile_str, notes):
+                if kind == "chunk":
+                    parts.append(payload)
+                else:
+                    reason = payload["finish_reason"]
+                yield kind, payload
+        else:
+            text, reason = await generate_medication_summary_async(meds_str, profile_str, notes)
+            parts.append(text)
+            yield "chunk", text
+        # A summary cut short (length limit, safety block) or empty is returned but not kept
+        html_output = "".join(parts)
+        if reason == "STOP" and html_output.strip():
+            await summary_cache.set(cache_key, html_output)
+        else:
+            print(f"[SummaryCache] Not caching summary (finish reason {reason or 'unknown'}, {len(html_output)} chars)")
+    return source()
+
+async def shared_summary(cache_key: str, prepare, interactions: dict = None) -> str:
+    flight = summary_flights.stream(cache_key, lambda: summary_source(cache_key, prepare, interactions, stream=False))
+    return "".join([payload async for kind, payload in flight.read() if kind == "chunk"])
+
+async def summary_event_stream(cache_key: str, prepare, interactions: dict = None):
+    # prepare() builds (meds_str, profile_str); it only runs on a cache miss
+    start = time.perf_counter()
+    elapsed_ms = lambda: round((time.perf_counter() - start) * 1000, 1)
+
+    # The precomputed flags go out first, before Gemini has produced anything
+    if interactions is not None:
+        yield sse_event("interactions", interactions)
+
+    html_output = await summary_cache.get(cache_key)
+    if html_output is not None:
+        yield sse_event("chunk", {"html": html_output})
+        yield sse_event("done", {"cached": True, "first_chunk_ms": elapsed_ms(), "total_ms": elapsed_ms()})
+        return
+
+    try:
+        first_chunk_ms = None
+        usage = {}
+        flight = summary_flights.stream(cache_key, lambda: summary_source(cache_key, prepare, interactions, stream=True))
+        async for kind, payload in flight.read():
+            if kind == "chunk":
+                if first_chunk_ms is None:
+                    first_chunk_ms = elapsed_ms()
+                yield sse_event("chunk", {"html": payload})
+            else:
+                usage = payload
+        yield sse_event("done", {"cached": False, "first_chunk_ms": first_chunk_ms, "total_ms": elapsed_ms(), **usage})
+    except GeminiUnavailable as e:
+        print(f"Error streaming summary: {e}")
+        yield sse_event("error", {"detail": str(e), "retry_after": max(1, math.ceil(e.retry_after))})
+    except Exception as e:
+        # Headers are already sent, so errors are reported in-band
+        print(f"Error streaming summary: {e}")
+        yield sse_event("error", {"detail": str(e)})
+
+def summary_inputs(active_prescriptions: list[dict]):
+    # (cache key, prepare, interactions) for a user's active list, summarized against DEFAULT_PROFILE
+    meds = [f"- {med.get('pres_name')}: {med.get('pres_strength')}" for med in active_prescriptions]
+    meds_str = "\n".join(meds)
+    interactions = check_interactions([med["pres_name"] for med in active_prescriptions if med.get("pres_name")])
+
+    async def prepare():
+        return meds_str, format_profile(DEFAULT_PROFILE)
+
+    return summary_cache.key(meds, DEFAULT_PROFILE), prepare, interactions
+
+async def member_summary(user_id: str, active_prescriptions: list[dict], version: int, limit: asyncio.Semaphore) -> dict:
+    # One line of a household response; errors are reported per member so the others still arrive
+    result = {"user_id": user_id, "version": version}
+    if not active_prescriptions:
+        return {**result, "status": "not_found" if version == 0 else "no_active_prescriptions"}
+
+    cache_key, prepare, interactions = summary_inputs(active_prescriptions)
+    try:
+        html_output = await summary_cache.get(cache_key)
+        cached = html_output is not None
+        if not cached:
+            async with limit:
+                html_output = await shared_summary(cache_key, prepare, interactions)
+        return {**result, "status": "ok", "cached": cached, "html": html_output, "interactions": interactions}
+    except GeminiUnavailable as e:
+        return {**result, "status": "error", "detail": str(e), "retry_after": max(1, math.ceil(e.retry_after))}
+    except Exception as e:
+        print(f"Error summarizing for {user_id}: {e}")
+        return {**result, "status": "error", "detail": str(e)}
+
+async def household_summary_stream(members: list[str], medications: dict):
+    limit = asyncio.Semaphore(HOUSEHOLD_CONCURRENCY)
+    tasks = [
+        asyncio.ensure_future(member_summary(member, *medications[member], limit))
+        for member in members
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done, default=str) + "\n"
+    finally:
+        # Client went away: stop waiting (shared Gemini calls still finish and get cached)
+        for task in tasks:
+            task.cancel()
+
+def stream_response(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def save_upload(src, file_path: str):
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(src, f)
+
+def remove_upload(job: dict):
+    # The stored PDF is only needed until its job is done or has failed for good
+    try:
+        os.remove(job["payload"]["file_path"])
+    except FileNotFoundError:
+        pass
+
 # === API Routes ===
 
 @app.get("/")
 async def api_entry():
     return {"Welcome": "RX-Check API"}
 
+# Liveness: the process is up and serving, even while warmup is still running
+@app.get("/healthz")
+async def healthz():
+    return {"status": "alive"}
+
+# Readiness: 200 once warmup has finished, 503 with the current stage until then
+@app.get("/readyz")
+async def readyz():
+    status_code = 200 if warmup_state["ready"] else 503
+    return JSONResponse(status_code=status_code, content=warmup_state)
+
+# Prometheus scrape endpoint: per-stage latency histograms, error and token counters
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 ## RESTRICTION: Frontend/client	Calls /query-drug/ repeatedly, stores list so implementation responsibility is on client##
 # README: This approach is not safe for production, as it offloads critical logic and validation to the client side.
 # Note: We were aware of this security and scalability concern but accepted it for the sake of rapid development during the hackathon.
@@ -122,20 +361,88 @@ Output:
     Note: Exact match mode will not include a "score" field.
 '''
 
-@app.post("/query-drug/")
+@app.post("/query-drug/", dependencies=[Depends(require_ready)])
 async def query_drug(request: QueryRequest):
     query_text = request.query_text.strip()
     if not query_text:
         raise HTTPException(status_code=400, detail="Query is empty.")
 
     queries = [q.strip() for q in query_text.split(",") if q.strip()]
-    results = []
-    for q in queries:
-        result = retrieve_drugs(q)
-        results.append({"query": q, **result})
+    lookups = await retrieve_drugs_bulk_async(queries)
+    results = [{"query": q, **result} for q, result in zip(queries, lookups)]
 
     return JSONResponse(content={"results": results})
 
+'''
+/query-drugs/bulk endpoint: resolve a whole regimen in one call.
+
+Input (JSON):
+{
+    "names": ["lisinopril", "Lipitor", "ibuprofen", "LISINOPRIL"]
+}
+
+Output: same shape as /query-drug/, one entry per distinct name (case-insensitive),
+in the order they were first given.
+'''
+@app.post("/query-drugs/bulk", dependencies=[Depends(require_ready)])
+async def query_drugs_bulk(request: BulkQueryRequest):
+    seen = {}
+    for name in request.names:
+        if name.strip():
+            seen.setdefault(name.strip().lower(), name.strip())
+    queries = list(seen.values())
+    if not queries:
+        raise HTTPException(status_code=400, detail="Query is empty.")
+
+    lookups = await retrieve_drugs_bulk_async(queries)
+    results = [{"query": q, **result} for q, result in zip(queries, lookups)]
+
+    return JSONResponse(content={"results": results})
+
+'''
+/autocomplete endpoint: typeahead for the drug search box, one call per keystroke.
+Answered from an in-memory index of catalog names; never touches the model or Pinecone.
+
+GET /autocomplete?q=lis&limit=5
+
+Output:
+{
+    "suggestions": [
+        {"name": "lisinopril", "type": "generic", "generic_name": "lisinopril", "rating": 6.9},
+        {"name": "Lipitor", "type": "brand", "generic_name": "atorvastatin", "rating": 6.1}, <---- rating is null when unrated
+        ...
+    ]
+}
+Best rated first, except that a name typed in full always comes first.
+'''
+@app.get("/autocomplete")
+async def autocomplete(q: str = Query(..., max_length=100), limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS)):
+    suggestions = suggest_names(q, limit)
+    if suggestions is None:
+        raise HTTPException(status_code=503, detail="Name index is not loaded.", headers={"Retry-After": "5"})
+    return {"suggestions": suggestions}
+
+
+'''
+/interactions/check endpoint: the deterministic conflict flags alone, without waiting for Gemini.
+
+Input (JSON):
+{
+    "names": ["warfarin", "ibuprofen", "alprazolam"]
+}
+
+Output: the "interactions" object described under /generate_plan
+'''
+@app.post("/interactions/check", dependencies=[Depends(require_ready)])
+async def interactions_check(request: BulkQueryRequest):
+    names = [name.strip() for name in request.names if name.strip()]
+    if not names:
+        raise HTTPException(status_code=400, detail="Query is empty.")
+    interactions = check_interactions(names)
+    if interactions is None:
+        raise HTTPException(status_code=503, detail="Interaction table is not loaded.")
+    return interactions
+
 
 ##### GEMINI ######
 
@@ -153,22 +460,54 @@ input (JSON) example
   }
 }
 
+Output:
+{
+    "html": "<h1>...",
+    "interactions": {           <---- precomputed from drug classes, see interactions.py (null if unavailable)
+        "conflicts": [{"drugs": ["Warfarin", "Ibuprofen"], "groups": ["anticoagulant", "nsaid"], "severity": "major", "reason": "..."}],
+        "duplicates": [{"drugs": [...], "drug_class": "..."}],
+        "warnings": [{"flag": "cns_depressant_stacking", "drugs": [...], "severity": "major", "reason": "..."}],
+        "unknown": ["names not in the catalog"]
+    }
+}
+
+Pass ?stream=true to get the HTML as server-sent events instead:
+    event: interactions   data: {"conflicts": [...], ...}   (first, straight away)
+    event: chunk   data: {"html": "<h1>..."}        (repeated as Gemini generates)
+    event: done    data: {"cached": false, "first_chunk_ms": ..., "total_ms": ..., "prompt_tokens": ..., ...}
+    event: error   data: {"detail": "...", "retry_after": 5}   (only if generation fails mid-stream; retry_after when Gemini is throttling or down)
 '''
-@app.post("/generate_plan")
-async def generate_medication_plan(data: MedicationRequest):
+@app.post("/generate_plan", dependencies=[Depends(require_ready)])
+async def generate_medication_plan(data: MedicationRequest, stream: bool = Query(False)):
     if not data.medications:
         raise HTTPException(status_code=400, detail="Medication list is empty.")
     try:
         med_names = [m.name for m in data.medications]
-        pinecone_defs = get_medication_definitions_for_gemini(med_names)
-        meds_str = "\n".join([f"- {m['name']}: {m['definition']}" for m in pinecone_defs])
-        profile_str = (
-            f"Age: {data.profile.age}\n"
-            f"Conditions: {', '.join(data.profile.conditions) or 'None'}\n"
-            f"Allergies: {', '.join(data.profile.allergies) or 'None'}"
-        )
-        html_output = generate_medication_summary(meds_str, profile_str)
-        return {"html": html_output}
+        profile = {
+            "age": data.profile.age,
+            "conditions": data.profile.conditions,
+            "allergies": data.profile.allergies
+        }
+
+        interactions = check_interactions(med_names)
+        profile_str = format_profile(profile)
+
+        async def prepare():
+            notes = format_for_prompt(interactions) if interactions else ""
+            return await medication_section(med_names, profile_str, notes), profile_str
+
+        # Same regimen + profile as an earlier request (from any patient) -> reuse that summary
+        cache_key = summary_cache.key(med_names, profile)
+        if stream:
+            return stream_response(summary_event_stream(cache_key, prepare, interactions))
+
+        html_output = await summary_cache.get(cache_key)
+        if html_output is None:
+            html_output = await shared_summary(cache_key, prepare, interactions)
+        return {"html": html_output, "interactions": interactions}
+    except GeminiUnavailable as e:
+        print(f"Error gen-erating plan: {e}")
+        raise gemini_unavailable(e)
     except Exception as e:
         print(f"Error gen-erating plan: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -254,168 +593,200 @@ async def allergies(user_id: str = Form(...), allergies: list[str] = Form(...)):
     user = await users_collection.find_one({"_id": user_id})
     return {"message": "Allergies updated successfully", "user": user}
 
-# === Models ===
-class QueryRequest(BaseModel):
-    query_text: str
-
-class MedicationEntry(BaseModel):
-    name: str
-    definition: Optional[str] = None
-
-class PatientProfile(BaseModel):
-    age: int
-    conditions: list[str] = []
-    allergies: list[str] = []
-
-class MedicationRequest(BaseModel):
-    medications: list[MedicationEntry]
-    profile: PatientProfile
-
-# === API Routes ===
-
-@app.get("/")
-async def api_entry():
-    return {"Welcome": "RX-Check API"}
-
-@app.post("/query-drug/")
-async def query_drug(request: QueryRequest):
-    query_text = request.query_text.strip()
-    if not query_text:
-        raise HTTPException(status_code=400, detail="Query is empty.")
-
-    queries = [q.strip() for q in query_text.split(",") if q.strip()]
-    results = []
-    for q in queries:
-        result = retrieve_drugs(q)
-        results.append({"query": q, **result})
-
-    return JSONResponse(content={"results": results})
-
-
-##### GEMINI ######
-
 '''
-input example
+/upload/ only stores the PDF and queues it; extraction, parsing and saving happen in the background.
+
+Output:
 {
-  "medications": [
-    { "name": "Lisinopril" },
-    { "name": "Ibuprofen" }
-  ],
-  "profile": {
-    "age": 65,
-    "conditions": ["hypertension", "osteoarthritis"],
-    "allergies": ["penicillin"]
-  }
+    "message": "Prescription queued",
+    "job_id": "3f2c...",
+    "status_url": "/jobs/3f2c..."
 }
 
+Poll /jobs/{job_id} for progress: status is queued -> running -> done (or failed),
+and stage is extract -> parse -> persist while running.
 '''
-@app.post("/generate_plan")
-async def generate_medication_plan(data: MedicationRequest):
-    if not data.medications:
-        raise HTTPException(status_code=400, detail="Medication list is empty.")
-    try:
-        med_names = [m.name for m in data.medications]
-        pinecone_defs = get_medication_definitions_for_gemini(med_names)
-        meds_str = "\n".join([f"- {m['name']}: {m['definition']}" for m in pinecone_defs])
-        profile_str = (
-            f"Age: {data.profile.age}\n"
-            f"Conditions: {', '.join(data.profile.conditions) or 'None'}\n"
-            f"Allergies: {', '.join(data.profile.allergies) or 'None'}"
-        )
-        html_output = generate_medication_summary(meds_str, profile_str)
-        return {"html": html_output}
-    except Exception as e:
-        print(f"Error gen-erating plan: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/upload/")
+@app.post("/upload/", status_code=202)
 async def upload_prescription(user_id: str = Form(...), file: UploadFile = File(...)):
     try:
         if file.content_type != "application/pdf":
             raise HTTPException(status_code=400, detail="Invalid file type. Must be PDF.")
 
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-
-        prescription_data = {
-            "user_id": user_id,
-            "prescriptions": [
-                {"name": "TEMAZEPAM", "pres_strength": "10 mg", "refills": 1, "date_prescribed": "2025-04-04", "active": True},
-                {"name": "CEFUROXIME", "pres_strength": "1.5 g", "refills": 2, "date_prescribed": "2025-04-04", "active": True},
-                {"name": "METRONIDAZOLE", "pres_strength": "500 mg", "refills": 1, "date_prescribed": "2025-04-04", "active": True},
-                {"name": "BRUFEN", "pres_strength": "800 mg", "refills": 0, "date_prescribed": "2025-04-04", "active": True}
-            ],
-            "date_uploaded": datetime.now(timezone.utc)
-        }
+        # Prefix with a random id so two uploads with the same filename don't overwrite each other
+        file_path = os.path.join(UPLOAD_DIR, f"{uuid4().hex}_{os.path.basename(file.filename or 'upload.pdf')}")
+        await run_in_threadpool(save_upload, file.file, file_path)
 
-        prescription_coll_exists = await prescriptions_collection.find_one({"user_id": user_id})
-        if prescription_coll_exists:
-            result = await prescriptions_collection.update_one(
-                {"user_id": user_id},
-                {
-                    "$setOnInsert": {"family_members": ["mom456", "dad789"]},
-                    "$push": {"documents": prescription_data}
-                },
-                upsert=True
-            )
-            return {"message": "Prescription saved successfully", "data": prescription_data}
-        else:
-            result = await prescriptions_collection.insert_one(prescription_data)
-            await users_collection.update_one(
-                {"_id": user_id},
-                {"$set": {"documents": str(result.inserted_id)}}
-            )
-            return {"message": "Prescription created successfully", "data": prescription_data}
-    
+        job_id = await job_queue.enqueue("upload", {"user_id": user_id, "file_path": file_path})
+        return {"message": "Prescription queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
+    except HTTPException:
+        raise
     except Exception as e:
         print("Internal Server Error:", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str = Path(...)):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "result": job["result"]
+    }
+
+# Background handler for "upload" jobs: store -> extract -> parse -> persist
+async def process_upload(queue: JobQueue, job: dict):
+    user_id = job["payload"]["user_id"]
+    file_path = job["payload"]["file_path"]
+
+    await queue.set_stage(job["id"], "extract")
+    with metrics.stage("pdf_extract"):
+        text = await asyncio.to_thread(extract_text_from_pdf, file_path)
+
+    await queue.set_stage(job["id"], "parse")
+    with metrics.stage("parse"):
+        parsed = parse_prescription(text)
+
+    await queue.set_stage(job["id"], "persist")
+    prescription_data = {
+        "user_id": user_id,
+        "job_id": job["id"],
+        "prescriptions": [
+            {
+                "pres_name": med["pres_name"],
+                "pres_strength": med["pres_strength"],
+                "route": med["route"],
+                "frequency": med["frequency"],
+                "refills": med["refills"],
+                "date_prescribed": med["date_prescribed"],
+                "active": med["active"]
+            }
+            for med in parsed["prescriptions"]
+        ],
+        "date_uploaded": datetime.now(timezone.utc)
+    }
+    await save_prescription_document(user_id, prescription_data)
+
+    return {"prescriptions": prescription_data["prescriptions"]}
+
+async def save_prescription_document(user_id: str, prescription_data: dict):
+    # A retried job must not append the same document twice
+    already_saved = await prescriptions_collection.find_one(
+        {"user_id": user_id, "documents.job_id": prescription_data["job_id"]}, {"_id": 1}
+    )
+    if already_saved:
+        # The document made it but the projection update may not have
+        await rebuild_active_medications(user_id)
+        return
+
+    result = await prescriptions_collection.update_one(
+        {"user_id": user_id},
+        {
+            "$setOnInsert": {"family_members": ["mom456", "dad789"]},
+            "$push": {"documents": prescription_data}
+        },
+        upsert=True
+    )
+    if result.upserted_id is not None:
+        await users_collection.update_one(
+            {"_id": user_id},
+            {"$set": {"documents": str(result.upserted_id)}}
+        )
+
+    await add_active_medications(user_id, prescription_data["job_id"], [
+        {
+            "pres_name": med["pres_name"],
+            "pres_strength": med["pres_strength"],
+            "refills": med["refills"],
+            "date_prescribed": med["date_prescribed"],
+            "date_uploaded": prescription_data["date_uploaded"]
+        }
+        for med in prescription_data["prescriptions"] if med["active"]
+    ])
+
+'''
+Output:
+{
+    "user_id": "abc",
+    "version": 3,   <---- goes up by one whenever the active list changes
+    "active_prescriptions": [ { "pres_name": ..., "pres_strength": ..., ... } ]
+}
+'''
 @app.get("/prescriptions/{user_id}")
 async def get_active_prescriptions(user_id: str = Path(...)):
-    user = await prescriptions_collection.find_one({"user_id": user_id})
-    if not user:
-        return {"user_id": user_id, "active_prescriptions": []}
-
-    active_prescriptions = []
-    for doc in user.get("documents", []):
-        for med in doc.get("prescriptions", []):
-            if med.get("active"):
-                active_prescriptions.append({
-                    "pres_name": med.get("pres_name"),
-                    "pres_strength": med.get("pres_strength"),
-                    "refills": med.get("refills"),
-                    "date_prescribed": med.get("date_prescribed"),
-                    "date_uploaded": doc.get("date_uploaded")
-                })
-
-    return {"user_id": user_id, "active_prescriptions": active_prescriptions}
-
-@app.get("/summaries/{user_id}")
-async def get_gemini_summary(user_id: str = Path(...)):
-    user = await prescriptions_collection.find_one({"user_id": user_id})
-    if not user:
+    active_prescriptions, version = await get_active_medications(user_id)
+    return {"user_id": user_id, "version": version, "active_prescriptions": active_prescriptions}
+
+'''
+Input (JSON):
+{
+    "pres_name": "TEMAZEPAM",
+    "active": false
+}
+Sets every prescription with that name in the user's history to active/inactive.
+'''
+@app.post("/prescriptions/{user_id}/status")
+async def set_prescription_status(update: PrescriptionStatusUpdate, user_id: str = Path(...)):
+    result = await prescriptions_collection.update_one(
+        {"user_id": user_id},
+        {"$set": {"documents.$[].prescriptions.$[med].active": update.active}},
+        array_filters=[{"$or": [{"med.pres_name": update.pres_name}, {"med.name": update.pres_name}]}]
+    )
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found.")
 
-    meds = []
-    for doc in user.get("documents", []):
-        for med in doc.get("prescriptions", []):
-            if med.get("active"):
-                meds.append(f"- {med.get('name')}: {med.get('pres_strength')}")
+    projection = await rebuild_active_medications(user_id)
+    return {"user_id": user_id, "version": projection["version"], "active_prescriptions": projection["medications"]}
 
-    if not meds:
+@app.get("/summaries/{user_id}", dependencies=[Depends(require_ready)])
+async def get_gemini_summary(user_id: str = Path(...), stream: bool = Query(False)):
+    active_prescriptions, version = await get_active_medications(user_id)
+    if not active_prescriptions:
+        if version == 0:
+            raise HTTPException(status_code=404, detail="User not found.")
         raise HTTPException(status_code=404, detail="No active prescriptions.")
 
-    profile_str = "Age: 65\nConditions: None\nAllergies: None"
-    meds_str = "\n".join(meds)
+    cache_key, prepare, interactions = summary_inputs(active_prescriptions)
+    if stream:
+        return stream_response(summary_event_stream(cache_key, prepare, interactions))
 
     try:
-        html_output = generate_medication_summary(meds_str, profile_str)
-        return {"html": html_output}
+        html_output = await summary_cache.get(cache_key)
+        if html_output is None:
+            html_output = await shared_summary(cache_key, prepare, interactions)
+        return {"html": html_output, "interactions": interactions}
+    except GeminiUnavailable as e:
+        raise gemini_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+'''
+Output (application/x-ndjson): one line per household member (the user, then their
+family_members), in the order the summaries are ready:
+{"user_id": "mom456", "version": 2, "status": "ok", "cached": false, "html": "...", "interactions": {...}}
+{"user_id": "dad789", "version": 0, "status": "not_found"}
+{"user_id": "abc", "version": 1, "status": "no_active_prescriptions"}
+{"user_id": "...", "version": 3, "status": "error", "detail": "...", "retry_after": 5}   <---- retry_after only when Gemini is unavailable
+'''
+@app.get("/households/{user_id}/summaries", dependencies=[Depends(require_ready)])
+async def get_household_summaries(user_id: str = Path(...)):
+    doc = await prescriptions_collection.find_one({"user_id": user_id}, {"_id": 0, "family_members": 1})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+
+    members = list(dict.fromkeys([user_id, *(doc.get("family_members") or [])]))
+    medications = await get_active_medications_many(members)
+    return StreamingResponse(
+        household_summary_stream(members, medications),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 
 def main():
     try:
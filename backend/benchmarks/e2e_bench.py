@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Offline end-to-end benchmark for the API. Pinecone, Gemini and MongoDB are replaced with
+# in-process fakes (see fakes.py and mongomock-motor), so no network or API keys are needed.
+# Run from the backend folder:
+#   pip install -r benchmarks/requirements.txt
+#   python benchmarks/e2e_bench.py --requests 200 --concurrency 16
+#   python benchmarks/e2e_bench.py --save-baseline benchmarks/baseline.json
+#   python benchmarks/e2e_bench.py --baseline benchmarks/baseline.json
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ["query-drug", "autocomplete", "generate_plan", "upload", "prescriptions", "summaries"]
+
+
+def setup_app(args, workdir: str):
+    # Everything the app reads at import time has to be in place before backend is imported
+    os.chdir(workdir)
+    os.environ.update({
+        "DB_NAME": "bench",
+        "JOBS_DB": os.path.join(workdir, "jobs.sqlite3"),
+        "EMBED_CACHE_DIR": "",
+    })
+    # The fake Gemini has no quota; measure the app, not the client-side rate limiter
+    os.environ.setdefault("GEMINI_RPM", "1000000")
+    os.environ.setdefault("GEMINI_BURST", "1000")
+
+    from mongomock_motor import AsyncMongoMockClient
+    from fakes import FakeEmbedder, FakeGeminiModel, FakePineconeIndex, write_synthetic_catalog
+    from parser_bench import synthetic_sheet
+
+    catalog_path = args.catalog or os.path.join(workdir, "drugs.csv")
+    if not args.catalog:
+        write_synthetic_catalog(catalog_path, args.catalog_size)
+
+    import db
+    client = AsyncMongoMockClient()
+    mock_db = client["bench"]
+    db.client, db.db = client, mock_db
+    for name in ["prescriptions_collection", "users_collection", "summary_cache_collection", "active_medications_collection"]:
+        setattr(db, name, db.InstrumentedCollection(mock_db[name.replace("_collection", "")]))
+
+    import drug_catalog
+    import gemini_response
+    import pinecone_query
+    from vector_store import LocalStore, PineconeStore
+
+    embedder = FakeEmbedder(latency_ms=args.embed_ms)
+    pinecone_query.load_catalog = lambda: drug_catalog.load_catalog(catalog_path)
+    pinecone_query.load_embedding_model = lambda backend: (embedder, "fake-embedder")
+    pinecone_query.open_vector_store = lambda backend, catalog: PineconeStore(
+        FakePineconeIndex(LocalStore.build(catalog, embedder.encode), latency_ms=args.pinecone_ms), "default"
+    )
+    gemini_response._model = FakeGeminiModel(args.gemini_ms, args.gemini_tokens_per_s, args.gemini_output_tokens)
+
+    import backend
+    async def mongomock_connection():
+        return True  # mongomock has no admin commands
+    backend.check_connection = mongomock_connection
+
+    sheet = synthetic_sheet(200)
+
+    def fake_extract(file_path, page_limit=-1):
+        time.sleep(args.ocr_ms / 1000)
+        return sheet
+    backend.extract_text_from_pdf = fake_extract
+
+    return backend, drug_catalog.load_catalog(catalog_path)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+async def run_endpoint(client, make_request, n_requests: int, concurrency: int):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(n_requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": n_requests,
+        "errors": errors,
+        "throughput_rps": round(n_requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+    }
+
+
+def request_factories(catalog, n_users: int, seed: int = 0):
+    rng = random.Random(seed)
+    names = catalog.names()
+    generics = list(catalog.generic_index)
+    pdf = b"%PDF-1.4\n%bench\n"
+
+    def typo(name):
+        i = rng.randrange(len(name))
+        return name[:i] + name[i + 1:]
+
+    async def query_drug(client, i):
+        # Mostly exact names, some misspellings that go down the semantic path
+        query = rng.choice(names) if rng.random() < 0.8 else typo(rng.choice(generics))
+        return await client.post("/query-drug/", json={"query_text": query})
+
+    async def autocomplete(client, i):
+        # One request per keystroke of a name being typed
+        name = rng.choice(names)
+        return await client.get("/autocomplete", params={"q": name[:rng.randint(1, len(name))]})
+
+    async def generate_plan(client, i):
+        meds = [{"name": n} for n in rng.sample(generics, rng.randint(3, 8))]
+        profile = {
+            "firstName": "Bench", "lastName": "User", "email": "bench@example.com", "password": "x",
+            "age": rng.choice([35, 50, 65, 80]), "conditions": [], "allergies": []
+        }
+        return await client.post("/generate_plan", json={"medications": meds, "profile": profile})
+
+    async def upload(client, i):
+        files = {"file": (f"sheet{i}.pdf", pdf, "application/pdf")}
+        return await client.post("/upload/", data={"user_id": f"user{i % n_users}"}, files=files)
+
+    async def prescriptions(client, i):
+        return await client.get(f"/prescriptions/user{i % n_users}")
+
+    async def summaries(client, i):
+        return await client.get(f"/summaries/user{i % n_users}")
+
+    return {
+        "query-drug": query_drug,
+        "autocomplete": autocomplete,
+        "generate_plan": generate_plan,
+        "upload": upload,
+        "prescriptions": prescriptions,
+        "summaries": summaries,
+    }
+
+
+async def seed_users(backend, catalog, n_users: int, docs_per_user: int, seed: int = 0):
+    from datetime import datetime, timezone
+    rng = random.Random(seed)
+    generics = list(catalog.generic_index)
+    for u in range(n_users):
+        for d in range(docs_per_user):
+            await backend.save_prescription_document(f"user{u}", {
+                "user_id": f"user{u}",
+                "job_id": f"seed-{u}-{d}",
+                "prescriptions": [
+                    {"pres_name": n, "pres_strength": "10 mg", "route": None, "frequency": None,
+                     "refills": 0, "date_prescribed": "2025-04-04", "active": rng.random() < 0.5}
+                    for n in rng.sample(generics, 4)
+                ],
+                "date_uploaded": datetime.now(timezone.utc)
+            })
+
+
+async def run(args):
+    import httpx
+
+    workdir = tempfile.mkdtemp(prefix="rxcheck-bench-")
+    backend, catalog = setup_app(args, workdir)
+
+    async with backend.lifespan(backend.app):
+        while not backend.warmup_state["ready"]:
+            if backend.warmup_state["error"]:
+                raise RuntimeError(f"Warmup failed: {backend.warmup_state['error']}")
+            await asyncio.sleep(0.05)
+        await seed_users(backend, catalog, args.users, args.docs_per_user)
+
+        transport = httpx.ASGITransport(app=backend.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            factories = request_factories(catalog, args.users)
+            results = {}
+            for name in args.endpoints:
+                results[name] = await run_endpoint(client, factories[name], args.requests, args.concurrency)
+                print(f"{name:>14}: {json.dumps(results[name])}")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    # A p95 more than `tolerance` above the baseline counts as a regression
+    ok = True
+    print(f"\n{'endpoint':>14} {'p95 base':>10} {'p95 now':>10} {'change':>8}")
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = (current["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        flag = " REGRESSION" if change > tolerance else ""
+        ok &= not flag
+        print(f"{name:>14} {base['p95_ms']:>10} {current['p95_ms']:>10} {change:>+8.1%}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end API benchmark")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--catalog", help="drugs.csv to use (default: synthetic)")
+    parser.add_argument("--catalog-size", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--docs-per-user", type=int, default=20)
+    parser.add_argument("--embed-ms", type=float, default=2.0, help="simulated encode time per text")
+    parser.add_argument("--pinecone-ms", type=float, default=30.0, help="simulated Pinecone round trip")
+    parser.add_argument("--gemini-ms", type=float, default=800.0, help="simulated Gemini time to first token")
+    parser.add_argument("--gemini-tokens-per-s", type=float, default=200.0)
+    parser.add_argument("--gemini-output-tokens", type=int, default=400)
+    parser.add_argument("--ocr-ms", type=float, default=50.0, help="simulated text extraction per upload")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 increase vs baseline")
+    parser.add_argument("--save-baseline", help="write results to this file")
+    args = parser.parse_args()
+
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+    if args.save_baseline:
+        args.save_baseline = os.path.abspath(args.save_baseline)
+    if args.catalog:
+        args.catalog = os.path.abspath(args.catalog)
+
+    results = asyncio.run(run(args))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            ok = compare(results, json.load(f), args.tolerance)
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import csv
+import hashlib
+import random
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from vector_store import LocalStore
+
+# In-process stand-ins for the paid services, so benchmarks run offline and repeatably.
+
+# Gemini reports finish reasons as enum members; only .name is read
+STOP = SimpleNamespace(name="STOP")
+
+
+class FakeEmbedder:
+    # Deterministic stand-in for SentenceTransformer: hashed character trigrams -> unit vector.
+    # Similar strings share trigrams, so semantic search still returns sensible neighbours.
+    def __init__(self, dim: int = 384, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _embed(self, text: str):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        padded = f"  {text.lower()}  "
+        for i in range(len(padded) - 2):
+            h = int.from_bytes(hashlib.blake2b(padded[i:i + 3].encode(), digest_size=4).digest(), "little")
+            vec[h % self.dim] += 1.0 if h & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def encode(self, texts, batch_size: int = 64, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if self.latency_ms:
+            time.sleep(self.latency_ms * len(texts) / 1000)
+        out = np.stack([self._embed(t) for t in texts]) if texts else np.empty((0, self.dim), np.float32)
+        return out[0] if single else out
+
+
+class FakePineconeIndex:
+    # Answers index.query(...) like the Pinecone client, from a LocalStore over the catalog,
+    # with an optional simulated network round trip.
+    def __init__(self, store: LocalStore, latency_ms: float = 0.0):
+        self.store = store
+        self.latency_ms = latency_ms
+
+    def query(self, vector, top_k: int = 10, filter: dict = None, include_metadata: bool = True, namespace: str = None):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return {"matches": self.store.query(vector, top_k=top_k, filter=filter)}
+
+
+class _FakeStream:
+    def __init__(self, chunks, delay_s: float, usage):
+        self.chunks = chunks
+        self.delay_s = delay_s
+        self.usage_metadata = usage
+
+    async def __aiter__(self):
+        for i, chunk in enumerate(self.chunks):
+            await asyncio.sleep(self.delay_s)
+            reason = STOP if i == len(self.chunks) - 1 else None
+            yield SimpleNamespace(text=chunk, parts=[chunk], candidates=[SimpleNamespace(finish_reason=reason)])
+
+
+class FakeGeminiModel:
+    # Mimics GenerativeModel: fixed time-to-first-token plus output at a fixed token rate
+    def __init__(self, latency_ms: float = 800.0, tokens_per_s: float = 60.0, output_tokens: int = 400):
+        self.latency_s = latency_ms / 1000
+        self.tokens_per_s = tokens_per_s
+        self.output_tokens = output_tokens
+
+    def _response(self, prompt: str):
+        usage = SimpleNamespace(
+            prompt_token_count=len(prompt) // 4,
+            candidates_token_count=self.output_tokens,
+            total_token_count=len(prompt) // 4 + self.output_tokens
+        )
+        words = ["<p>Take", "with", "food.</p>"] * (self.output_tokens // 3)
+        return " ".join(words), usage
+
+    def _duration(self) -> float:
+        return self.latency_s + self.output_tokens / self.tokens_per_s
+
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        text, usage = self._response(str(prompt))
+        if stream:
+            await asyncio.sleep(self.latency_s)
+            chunks = [text[i:i + 200] for i in range(0, len(text), 200)]
+            return _FakeStream(chunks, (self._duration() - self.latency_s) / max(len(chunks), 1), usage)
+        await asyncio.sleep(self._duration())
+        return SimpleNamespace(text=text, parts=[text], candidates=[SimpleNamespace(finish_reason=STOP)], usage_metadata=usage)
+
+    def generate_content(self, prompt, **kwargs):
+        text, usage = self._response(str(prompt))
+        time.sleep(self._duration())
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def start_chat(self):
+        return SimpleNamespace(send_message=self.generate_content)
+
+
+CLASSES = ["Statins", "ACE inhibitors", "NSAIDs", "Benzodiazepines", "Opioids", "SSRI antidepressants",
+           "Cephalosporins", "Contraceptives", "Anticoagulants", "Antihistamines"]
+SYLLABLES = ["ator", "va", "sta", "tin", "lis", "ino", "pril", "ibu", "pro", "fen", "zo", "pam", "met", "for", "min", "cef", "ur", "ox"]
+
+
+def write_synthetic_catalog(path: str, n_drugs: int = 3000, seed: int = 0) -> list[str]:
+    # drugs.csv-shaped file with made-up names; returns the generic names
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n_drugs:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    names = sorted(names)
+
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=[
+            "drug_name", "generic_name", "drug_classes", "brand_names", "alcohol",
+            "pregnancy_category", "csa", "rx_otc", "rating"
+        ])
+        writer.writeheader()
+        for name in names:
+            writer.writerow({
+                "drug_name": name,
+                "generic_name": name,
+                "drug_classes": rng.choice(CLASSES),
+                "brand_names": ", ".join(n.title() for n in rng.sample(names, 2)),
+                "alcohol": rng.choice(["X", ""]),
+                "pregnancy_category": rng.choice("ABCDXN"),
+                "csa": rng.choice("N2345"),
+                "rx_otc": rng.choice(["Rx", "OTC", "Rx/OTC"]),
+                "rating": round(rng.uniform(1, 10), 1),
+            })
+    return names
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import sys
+
+# Per-process memory of a running deployment (a gunicorn master and its workers, or a single
+# uvicorn process), read from /proc/<pid>/smaps_rollup, so Linux only.
+# RSS counts a shared page in every process that maps it; PSS divides it between them, so the
+# PSS total is what the deployment really costs. With preloading, most of each worker's RSS
+# should show up as Shared_* rather than Private_*.
+#
+# Usage: python benchmarks/memory_report.py <master pid> [--json]
+
+FIELDS = ["Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"]
+
+
+def read_rollup(pid: int) -> dict:
+    # kB per field
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[0].rstrip(":") in FIELDS:
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return values
+
+def children(pid: int) -> list[int]:
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name can contain spaces; the parent pid is the 2nd field after it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            found.append(int(entry))
+    return sorted(found)
+
+def command(pid: int) -> str:
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+
+def report(pid: int) -> list[dict]:
+    rows = []
+    for role, p in [("master", pid), *(("worker", c) for c in children(pid))]:
+        try:
+            rows.append({"role": role, "pid": p, "cmd": command(p), **read_rollup(p)})
+        except OSError as e:
+            print(f"[Memory] Skipping {p}: {e}", file=sys.stderr)
+    return rows
+
+def print_table(rows: list[dict]):
+    mb = lambda kb: f"{kb / 1024:.1f}"
+    print(f"{'role':<7} {'pid':>7} " + " ".join(f"{field:>14}" for field in FIELDS) + "   (MB)")
+    for row in rows:
+        print(f"{row['role']:<7} {row['pid']:>7} " + " ".join(f"{mb(row.get(field, 0)):>14}" for field in FIELDS))
+
+    workers = [row for row in rows if row["role"] == "worker"]
+    print(f"\ntotal RSS {mb(sum(row.get('Rss', 0) for row in rows))} MB, "
+          f"total PSS {mb(sum(row.get('Pss', 0) for row in rows))} MB")
+    if workers:
+        print(f"per worker: RSS {mb(sum(row.get('Rss', 0) for row in workers) / len(workers))} MB, "
+              f"private {mb(sum(row.get('Private_Clean', 0) + row.get('Private_Dirty', 0) for row in workers) / len(workers))} MB "
+              f"over {len(workers)} workers")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident memory of an API master process and its workers")
+    parser.add_argument("pid", type=int, help="gunicorn master (or single uvicorn) pid")
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON (values in kB)")
+    args = parser.parse_args()
+
+    rows = report(args.pid)
+    if not rows:
+        sys.exit(f"No process {args.pid}")
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
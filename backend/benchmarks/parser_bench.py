@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# Benchmark for ocr_parser.parse_prescription on synthetic discharge sheets.
+# Run from the backend folder:
+#   python benchmarks/parser_bench.py --lines 5000 --repeat 20
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ocr_parser import parse_prescription, IGNORE_KEYWORDS
+
+DRUGS = [
+    "TEMAZEPAM", "CEFUROXIME", "METRONIDAZOLE", "BRUFEN", "Lisinopril", "Atorvastatin",
+    "Amoxicillin clavulanate", "Metformin", "Omeprazole", "Paracetamol", "Warfarin", "Sertraline"
+]
+DOSES = ["10 mg", "1.5 g", "500mg", "800 MG", "20 mg", "625 mg", "5 ml", "100 mcg"]
+ROUTES = ["oral", "PO", "IV", "IM", "SC", "", ""]
+FREQUENCIES = ["once daily", "bd", "tds", "nocte", "prn", "every 8 hours", ""]
+NOISE = [
+    "Signature of prescriber ____________", "Allergies: none known", "Page 2 of 4",
+    "Indication: post-operative infection", "Pharmacy use only", "Nurse initials  AB  CD  EF",
+]
+
+
+def synthetic_sheet(n_lines: int, seed: int = 0) -> str:
+    # Roughly a third medication lines, the rest headers, boilerplate and OCR noise
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(n_lines):
+        kind = rng.random()
+        if kind < 0.35:
+            line = f"{rng.choice(DRUGS)} {rng.choice(DOSES)} {rng.choice(ROUTES)} {rng.choice(FREQUENCIES)}"
+            if rng.random() < 0.2:
+                line += f" refills: {rng.randint(0, 5)}"
+            if rng.random() < 0.2:
+                line += f" {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025"
+        elif kind < 0.6:
+            line = f"{rng.choice(IGNORE_KEYWORDS)}: {rng.randint(1000, 9999)}"
+        else:
+            line = rng.choice(NOISE)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse_prescription throughput")
+    parser.add_argument("--lines", type=int, default=5000, help="lines per synthetic sheet")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs (best is reported)")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    text = synthetic_sheet(args.lines)
+    parse_prescription(text)  # warm up
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = parse_prescription(text)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    report = {
+        "lines": args.lines,
+        "prescriptions": len(result["prescriptions"]),
+        "best_ms": round(best * 1000, 3),
+        "median_ms": round(sorted(timings)[len(timings) // 2] * 1000, 3),
+        "lines_per_second": round(args.lines / best),
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,46 @@
+import asyncio
 import os
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+import metrics
 
 load_dotenv()
 
 MONGODB_URI = os.getenv("MONGODB_URI")
 DB_NAME = os.getenv("DB_NAME")
 
+class InstrumentedCollection:
+    # Wraps a Motor collection so every awaited operation is timed as a "mongo.<collection>.<op>" stage.
+    # Cursor methods (find, aggregate) pass through; time those with metrics.stage at the call site.
+    TIMED = {
+        "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+        "delete_one", "delete_many", "find_one_and_update", "count_documents", "create_index"
+    }
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name not in self.TIMED:
+            return attr
+
+        stage = f"mongo.{self.collection.name}.{name}"
+        async def timed(*args, **kwargs):
+            with metrics.stage(stage):
+                return await attr(*args, **kwargs)
+        return timed
+
 client = AsyncIOMotorClient(MONGODB_URI)
 db = client[DB_NAME]
-prescriptions_collection = db["prescriptions"]
-users_collection = db["users"]
+prescriptions_collection = InstrumentedCollection(db["prescriptions"])
+users_collection = InstrumentedCollection(db["users"])
+summary_cache_collection = InstrumentedCollection(db["summary_cache"])
+# Denormalized, versioned list of each user's active medications, maintained on every write
+active_medications_collection = InstrumentedCollection(db["active_medications"])
 # Function to check if the database connection is working
 async def check_connection():
     try:
@@ -20,3 +50,114 @@ async def check_connection():
     except Exception as e:
         print(f"MongoDB connection error: {e}")
         return False
+
+# Indexes the API relies on; safe to call on every startup
+async def ensure_indexes():
+    try:
+        await prescriptions_collection.create_index("user_id", unique=True)
+        await prescriptions_collection.create_index([("user_id", 1), ("documents.prescriptions.active", 1)])
+        await active_medications_collection.create_index("user_id", unique=True)
+    except Exception as e:
+        print(f"MongoDB index creation error: {e}")
+
+# Only the active medications leave the server, flattened to one row per medication, together
+# with the job ids of the uploads they came from (both from the same read of the document)
+async def fetch_active_prescriptions(user_id: str) -> tuple[list[dict], list[str]]:
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$facet": {
+            "medications": [
+                {"$unwind": "$documents"},
+                {"$unwind": "$documents.prescriptions"},
+                {"$match": {"documents.prescriptions.active": True}},
+                {"$project": {
+                    "_id": 0,
+                    # Older documents stored the drug under "name" instead of "pres_name"
+                    "pres_name": {"$ifNull": ["$documents.prescriptions.pres_name", "$documents.prescriptions.name"]},
+                    "pres_strength": "$documents.prescriptions.pres_strength",
+                    "refills": "$documents.prescriptions.refills",
+                    "date_prescribed": "$documents.prescriptions.date_prescribed",
+                    "date_uploaded": "$documents.date_uploaded"
+                }}
+            ],
+            "jobs": [
+                {"$unwind": "$documents"},
+                {"$match": {"documents.job_id": {"$exists": True}}},
+                {"$project": {"_id": 0, "job_id": "$documents.job_id"}}
+            ]
+        }}
+    ]
+    with metrics.stage("mongo.prescriptions.aggregate"):
+        result = await prescriptions_collection.aggregate(pipeline).to_list(length=None)
+    if not result:
+        return [], []
+    return result[0]["medications"], [doc["job_id"] for doc in result[0]["jobs"]]
+
+# --- active_medications projection ---
+# Writes keep it current; reads are a single indexed lookup. "version" goes up by one on
+# every change, so (user_id, version) identifies a medication list without reading it.
+
+async def get_active_medications(user_id: str):
+    doc = await active_medications_collection.find_one({"user_id": user_id}, {"_id": 0, "medications": 1, "version": 1})
+    if doc is None:
+        # Version 0 means the user has never uploaded anything
+        if not await prescriptions_collection.find_one({"user_id": user_id}, {"_id": 1}):
+            return [], 0
+        # Users from before the projection existed: build it once from the upload history
+        doc = await rebuild_active_medications(user_id)
+    return doc["medications"], doc["version"]
+
+async def get_active_medications_many(user_ids: list[str]) -> dict:
+    # One $in query for a whole household; {user_id: (medications, version)} like get_active_medications
+    with metrics.stage("mongo.active_medications.find"):
+        docs = await active_medications_collection.find(
+            {"user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1, "medications": 1, "version": 1}
+        ).to_list(length=None)
+    found = {doc["user_id"]: (doc["medications"], doc["version"]) for doc in docs}
+
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        # Rare: members without a projection yet go through the single-user path (and get one built)
+        for user_id, result in zip(missing, await asyncio.gather(*(get_active_medications(u) for u in missing))):
+            found[user_id] = result
+    return found
+
+async def add_active_medications(user_id: str, job_id: str, medications: list[dict]):
+    # Called after the upload is pushed onto the user's prescriptions document. applied_jobs makes
+    # this a no-op if a rebuild in between (status change, lazy first read) already included it.
+    result = await active_medications_collection.update_one(
+        {"user_id": user_id, "applied_jobs": {"$ne": job_id}},
+        {
+            "$push": {"medications": {"$each": medications}},
+            "$addToSet": {"applied_jobs": job_id},
+            "$inc": {"version": 1},
+            "$set": {"updated_at": datetime.now(timezone.utc)}
+        }
+    )
+    if result.matched_count == 0 and not await active_medications_collection.find_one({"user_id": user_id}, {"_id": 1}):
+        await rebuild_active_medications(user_id)
+
+async def rebuild_active_medications(user_id: str, attempts: int = 5):
+    # Optimistic concurrency: only replace the list if nobody changed it while we recomputed
+    for _ in range(attempts):
+        current = await active_medications_collection.find_one({"user_id": user_id}, {"version": 1})
+        medications, job_ids = await fetch_active_prescriptions(user_id)
+        now = datetime.now(timezone.utc)
+
+        if current is None:
+            try:
+                await active_medications_collection.insert_one(
+                    {"user_id": user_id, "version": 1, "medications": medications, "applied_jobs": job_ids, "updated_at": now}
+                )
+                return {"medications": medications, "version": 1}
+            except DuplicateKeyError:
+                continue
+
+        result = await active_medications_collection.update_one(
+            {"user_id": user_id, "version": current["version"]},
+            {"$set": {"medications": medications, "applied_jobs": job_ids, "updated_at": now}, "$inc": {"version": 1}}
+        )
+        if result.modified_count:
+            return {"medications": medications, "version": current["version"] + 1}
+
+    raise RuntimeError(f"Could not rebuild active medications for {user_id}: too many concurrent updates")
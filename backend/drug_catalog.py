@@ -0,0 +1,127 @@
+import csv
+import os
+import sys
+from array import array
+from dotenv import load_dotenv
+
+# In-memory copy of the drug catalog (the same rows pinecone_init.py upserts).
+# Used to answer exact-name lookups without a round trip to Pinecone.
+
+load_dotenv()
+DRUGS_CSV = os.getenv("DRUGS_CSV", "drugs.csv")
+MISSING = "Unknown"
+
+
+def split_components(generic_name: str) -> list[str]:
+    # Split combo names like "ethinyl estradiol / norgestimate"
+    return [name.strip() for name in generic_name.split("/")]
+
+
+def split_brands(brand_names: str) -> list[str]:
+    if not brand_names or brand_names == MISSING:
+        return []
+    return [b.strip() for b in brand_names.split(",") if b.strip()]
+
+
+def _parse_rating(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class DrugCatalog:
+    # Column store: one list/array per metadata field, one row per generic component.
+    # Strings are interned so repeated classes/flags share a single object.
+    def __init__(self):
+        self.generic_name = []
+        self.full_name = []
+        self.drug_class = []
+        self.alcohol = []
+        self.pregnancy = []
+        self.csa = []
+        self.brand_names = []
+        self.rx_otc = []
+        self.indications = []
+        self.rating = array("f")
+        # lowercased generic/brand name -> tuple of row ids
+        self.generic_index = {}
+        self.brand_index = {}
+
+    def __len__(self):
+        return len(self.generic_name)
+
+    def add(self, row: dict):
+        s = sys.intern
+        generic_name = row.get("generic_name") or MISSING
+        brand_names = row.get("brand_names") or MISSING
+
+        for name in split_components(generic_name):
+            i = len(self.generic_name)
+            self.generic_name.append(s(name.lower()))
+            self.full_name.append(generic_name)
+            self.drug_class.append(s(row.get("drug_classes") or MISSING))
+            self.alcohol.append(s(row.get("alcohol") or MISSING))
+            self.pregnancy.append(s(row.get("pregnancy_category") or MISSING))
+            self.csa.append(s(row.get("csa") or MISSING))
+            self.brand_names.append(brand_names)
+            self.rx_otc.append(s(row.get("rx_otc") or MISSING))
+            # pinecone_init falls back to this when drugs.csv has no indications column
+            indications = row.get("indications", "various medical conditions")
+            self.indications.append(s(indications or MISSING))
+            self.rating.append(_parse_rating(row.get("rating")))
+
+            self._index(self.generic_index, name.lower(), i)
+            for brand in split_brands(brand_names):
+                self._index(self.brand_index, brand.lower(), i)
+
+    @staticmethod
+    def _index(index: dict, key: str, i: int):
+        key = sys.intern(key)
+        ids = index.get(key)
+        index[key] = (i,) if ids is None else ids + (i,)
+
+    def metadata(self, i: int) -> dict:
+        # Same shape as the metadata stored alongside each Pinecone vector
+        rating = self.rating[i]
+        return {
+            "generic_name": self.generic_name[i],
+            "full_name": self.full_name[i],
+            "drug_class": self.drug_class[i],
+            "alcohol": self.alcohol[i],
+            "pregnancy": self.pregnancy[i],
+            "csa": self.csa[i],
+            "brand_names": self.brand_names[i],
+            "rx_otc": self.rx_otc[i],
+            "rating": MISSING if rating != rating else round(rating, 1),
+        }
+
+    def document_text(self, i: int) -> str:
+        # The text that gets embedded for each row (see pinecone_init.py)
+        return (
+            f"{self.generic_name[i]} is a medication often found in the combination drug '{self.full_name[i]}'. "
+            f"It belongs to the {self.drug_class[i]} class and is used to treat {self.indications[i]}. "
+            f"It is categorized as {self.rx_otc[i]}, pregnancy category {self.pregnancy[i]}, "
+            f"CSA schedule {self.csa[i]}, and has alcohol interaction status '{self.alcohol[i]}'."
+        )
+
+    def names(self) -> list[str]:
+        # Every lowercased generic and brand name, e.g. for prewarming embeddings
+        return list(self.generic_index) + [b for b in self.brand_index if b not in self.generic_index]
+
+    def lookup(self, name: str) -> tuple:
+        # Generic names win over brand names, matching the old $eq filter on generic_name
+        key = name.strip().lower()
+        return self.generic_index.get(key) or self.brand_index.get(key) or ()
+
+
+def load_catalog(path: str = DRUGS_CSV):
+    if not os.path.exists(path):
+        print(f"[Catalog] {path} not found, exact lookups will go to Pinecone")
+        return None
+
+    catalog = DrugCatalog()
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            catalog.add(row)
+    return catalog
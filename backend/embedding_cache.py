@@ -0,0 +1,175 @@
+import fcntl
+import os
+import random
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Query-embedding cache: a bounded in-memory LRU in front of an append-only,
+# memory-mapped store on disk so encodes survive restarts and are shared by workers.
+# Only prewarmed (catalog) names go to disk, which keeps the store bounded by the catalog;
+# other queries are kept in the LRU only.
+#
+# On disk, per (model, dim):
+#   <name>.f32   raw float32 rows, one embedding per row
+#   <name>.keys  "row\ttext" lines mapping normalized text -> row
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, dim: int, cache_dir: str = None, max_items: int = 10000):
+        self.dim = dim
+        self.max_items = max_items
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.rows = {}
+        self.keys_offset = 0 # bytes of the keys file already read into rows
+        self.matrix = None
+        self.vectors_path = self.keys_path = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name) + f"-{dim}"
+            self.vectors_path = os.path.join(cache_dir, name + ".f32")
+            self.keys_path = os.path.join(cache_dir, name + ".keys")
+            self._load()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _load(self):
+        if not os.path.exists(self.keys_path) or not os.path.exists(self.vectors_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            n_rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            self._read_keys(f, n_rows)
+        self._remap(n_rows)
+
+    def _read_keys(self, keys_file, n_rows: int):
+        # Picks up key lines written since the last read, by this worker or another one.
+        # A row only counts once both its vector and its key made it to disk; an unterminated
+        # last line was cut short by a crash mid-write and is left for the writer to drop.
+        keys_file.seek(self.keys_offset)
+        data = keys_file.read()
+        data = data[:data.rfind(b"\n") + 1]
+        for line in data.decode("utf-8").splitlines():
+            row, _, text = line.partition("\t")
+            if row.isdigit() and int(row) < n_rows:
+                self.rows[text] = int(row)
+        self.keys_offset += len(data)
+
+    def refresh(self):
+        # Rows other workers have added since we last looked
+        if self.keys_path is None or not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            self._read_keys(f, os.path.getsize(self.vectors_path) // (self.dim * 4))
+
+    def _remap(self, n_rows: int):
+        if n_rows:
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+
+    def get(self, key: str):
+        vec = self.lru.get(key)
+        if vec is not None:
+            self.lru.move_to_end(key)
+            return vec
+
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        if self.matrix is None or row >= self.matrix.shape[0]:
+            self._remap(os.path.getsize(self.vectors_path) // (self.dim * 4))
+        vec = np.array(self.matrix[row])
+        self._remember(key, vec)
+        return vec
+
+    def _remember(self, key: str, vec):
+        self.lru[key] = vec
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_items:
+            self.lru.popitem(last=False)
+
+    def put_many(self, keys: list[str], vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(keys), self.dim)
+        for key, vec in zip(keys, vectors):
+            self._remember(key, vec)
+        if self.keys_path is None:
+            return
+
+        # Other workers may append at the same time; the lock keeps rows and keys aligned
+        with open(self.keys_path, "a+b") as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            row_bytes = self.dim * 4
+            self._drop_partial_key_line(keys_file)
+            with open(self.vectors_path, "ab") as vectors_file:
+                # A crash mid-write can leave a partial row at the end; drop it so new rows stay aligned
+                size = os.fstat(vectors_file.fileno()).st_size
+                if size % row_bytes:
+                    vectors_file.truncate(size - size % row_bytes)
+                start = size // row_bytes
+                # Skip anything another worker wrote in the meantime
+                self._read_keys(keys_file, start)
+                new = [i for i, key in enumerate(keys) if key not in self.rows]
+                if not new:
+                    return
+                vectors_file.write(vectors[new].tobytes())
+            lines = "".join(f"{start + n}\t{keys[i]}\n" for n, i in enumerate(new)).encode("utf-8")
+            keys_file.write(lines)
+            self.keys_offset += len(lines)
+        for n, i in enumerate(new):
+            self.rows[keys[i]] = start + n
+
+    def _drop_partial_key_line(self, keys_file):
+        # Same for a half-written key line: its text may be cut short, so it can't be trusted
+        size = os.fstat(keys_file.fileno()).st_size
+        if not size:
+            return
+        keys_file.seek(size - 1)
+        if keys_file.read(1) == b"\n":
+            return
+        keys_file.seek(0)
+        keys_file.truncate(keys_file.read().rfind(b"\n") + 1)
+
+    def encode(self, texts: list[str], encode_fn):
+        # Returns one row per input text; only the misses are sent to encode_fn
+        keys = [normalize(t) for t in texts]
+        with self.lock:
+            found = {key: self.get(key) for key in dict.fromkeys(keys)}
+        misses = [key for key, vec in found.items() if vec is None]
+
+        if misses:
+            vectors = np.asarray(encode_fn(misses), dtype=np.float32)
+            with self.lock:
+                for key, vec in zip(misses, vectors):
+                    self._remember(key, vec)
+            found.update(zip(misses, vectors))
+
+        return np.stack([found[key] for key in keys]) if keys else np.empty((0, self.dim), np.float32)
+
+    def prewarm(self, texts, encode_fn, batch_size: int = 256):
+        # Encode everything not already on disk, in large batches. Each batch first picks up what
+        # other workers have written; going through the batches in random order lets workers
+        # booting together split the catalog instead of all encoding it in the same order.
+        pending = [key for key in dict.fromkeys(normalize(t) for t in texts if t) if key not in self.rows]
+        starts = list(range(0, len(pending), batch_size))
+        random.shuffle(starts)
+        encoded = 0
+        for i in starts:
+            with self.lock:
+                self.refresh()
+                batch = [key for key in pending[i:i + batch_size] if key not in self.rows]
+            if not batch:
+                continue
+            vectors = np.asarray(encode_fn(batch), dtype=np.float32)
+            with self.lock:
+                self.put_many(batch, vectors)
+            encoded += len(batch)
+        return encoded
@@ -0,0 +1,356 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+import metrics
+
+# Guards every Gemini call so a throttled or failing upstream can't pile up hung requests:
+# - a token bucket keeps us under the quota (GEMINI_RPM, split evenly between WEB_CONCURRENCY processes)
+# - AIMD concurrency: the in-flight limit grows slowly while calls succeed and halves on 429s,
+#   timeouts or slow responses
+# - retries with jittered exponential backoff, but never past the call's deadline
+# - a circuit breaker that fails fast for a while after repeated upstream failures
+# Anything that gives up raises GeminiUnavailable; the API turns that into a 503 with Retry-After.
+
+load_dotenv()
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))                     # requests per minute our quota allows
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+# Each API process has its own bucket. gunicorn.conf.py and uvicorn --workers both default their
+# worker count to WEB_CONCURRENCY, so each process gets that share of the quota.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_LATENCY_TARGET = float(os.getenv("GEMINI_LATENCY_TARGET", "20")) # seconds; slower calls count as congestion
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "60"))             # per summary, retries included
+GEMINI_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "30"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class GeminiUnavailable(Exception):
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def classify(error: Exception):
+    # "throttled", "timeout" or "unavailable" for upstream trouble worth retrying; None otherwise
+    # (bad request, blocked prompt, ...). google.api_core errors carry the HTTP status as .code.
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout"
+    code = getattr(error, "code", None)
+    name = type(error).__name__
+    if code == 429 or name in ("ResourceExhausted", "TooManyRequests"):
+        return "throttled"
+    if name == "DeadlineExceeded" or code == 504:
+        return "timeout"
+    if (isinstance(code, int) and code >= 500) or name in ("ServiceUnavailable", "InternalServerError", "BadGateway"):
+        return "unavailable"
+    if isinstance(error, ConnectionError):
+        return "unavailable"
+    return None
+
+def backoff(attempt: int) -> float:
+    # Full jitter: spreads retries from many workers instead of having them return in lockstep
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_s: float, burst: int):
+        self.rate = rate_per_s
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # Takes a token; returns how long to wait before using it (0 if one was available)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class AdaptiveConcurrency:
+    # Additive increase (about +1 per round of successful calls), multiplicative decrease
+    # (halve, at most once per second) on throttling, timeouts or responses over the latency target
+    DECREASE_INTERVAL = 1.0
+
+    def __init__(self, maximum: int, minimum: int = 1, latency_target: float = GEMINI_LATENCY_TARGET):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.latency_target = latency_target
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.waiters = deque()
+        self.last_decrease = 0.0
+        metrics.gemini_concurrency_limit.set(self.limit)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, max(timeout, 0))
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return False
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def on_success(self, latency: float):
+        if latency > self.latency_target:
+            self.on_congestion()
+            return
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        metrics.gemini_concurrency_limit.set(self.limit)
+        self._wake()
+
+    def on_congestion(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.DECREASE_INTERVAL:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        metrics.gemini_concurrency_limit.set(self.limit)
+
+
+class CircuitBreaker:
+    # closed -> open after `failures` upstream failures in a row; after `cooldown` one probe call
+    # is let through (half-open), and its result closes or re-opens the circuit
+    def __init__(self, failures: int = GEMINI_BREAKER_FAILURES, cooldown: float = GEMINI_BREAKER_COOLDOWN, probe_timeout: float = GEMINI_ATTEMPT_TIMEOUT):
+        self.failures_allowed = failures
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        # (wait, probe): wait is 0 if a call may go ahead, otherwise seconds until it is worth trying
+        # again. probe is set when this call is the half-open probe; pass it to abandon() if the
+        # call ends up never reaching Gemini (or is cancelled), so the next call can probe instead.
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0, None
+            now = time.monotonic()
+            remaining = self.opened_at + self.cooldown - now
+            if remaining > 0:
+                return remaining, None
+            if self.probe_started is not None and now - self.probe_started < self.probe_timeout:
+                return self.probe_timeout - (now - self.probe_started), None
+            self.probe_started = now
+            metrics.gemini_breaker_state.set(1)
+            return 0.0, now
+
+    def abandon(self, probe):
+        with self.lock:
+            if probe is not None and self.probe_started == probe:
+                self.probe_started = None
+                metrics.gemini_breaker_state.set(2)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+            metrics.gemini_breaker_state.set(0)
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probe_started is not None or self.failures >= self.failures_allowed:
+                if self.opened_at is None or self.probe_started is not None:
+                    print(f"[Gemini] Circuit open for {self.cooldown:.0f}s after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+                metrics.gemini_breaker_state.set(2)
+
+
+class GeminiClient:
+    def __init__(self, get_model):
+        self.get_model = get_model
+        self.bucket = TokenBucket(GEMINI_RPM / 60 / WEB_CONCURRENCY, max(1.0, GEMINI_BURST / WEB_CONCURRENCY))
+        self.limiter = AdaptiveConcurrency(GEMINI_MAX_CONCURRENCY)
+        self.breaker = CircuitBreaker()
+
+    def _check_breaker(self):
+        # Returns the probe token (see CircuitBreaker.allow)
+        wait, probe = self.breaker.allow()
+        if wait:
+            metrics.gemini_rejected.inc(reason="circuit_open")
+            raise GeminiUnavailable("Gemini is unavailable right now, please retry shortly.", wait)
+        return probe
+
+    def _reserve_token(self, deadline: float) -> float:
+        delay = self.bucket.reserve()
+        if delay > deadline - time.monotonic():
+            self.bucket.refund()
+            metrics.gemini_rejected.inc(reason="rate_limited")
+            raise GeminiUnavailable("Gemini request quota reached, please retry shortly.", delay)
+        return delay
+
+    async def _admit(self, deadline: float):
+        # Returns the probe token; holds a concurrency slot on success
+        probe = self._check_breaker()
+        try:
+            delay = self._reserve_token(deadline)
+            if delay:
+                await asyncio.sleep(delay)
+            if not await self.limiter.acquire(deadline - time.monotonic()):
+                metrics.gemini_rejected.inc(reason="overloaded")
+                raise GeminiUnavailable("Too many Gemini calls in flight, please retry shortly.", 1.0)
+        except BaseException:
+            self.breaker.abandon(probe)
+            raise
+        return probe
+
+    def _retry_delay(self, error: Exception, attempt: int, deadline: float) -> float:
+        # Records the failure; returns how long to wait before the next attempt or raises
+        kind = classify(error)
+        if kind is None:
+            # Gemini answered, it just didn't like the request: not a health problem, not retryable
+            self.breaker.success()
+            raise error
+        self.breaker.failure()
+        if kind in ("throttled", "timeout"):
+            self.limiter.on_congestion()
+
+        delay = backoff(attempt)
+        if attempt >= GEMINI_MAX_RETRIES or time.monotonic() + delay >= deadline:
+            metrics.gemini_rejected.inc(reason=kind)
+            raise GeminiUnavailable(f"Gemini call failed ({kind}): {error or type(error).__name__}", max(delay, 1.0)) from error
+        metrics.gemini_retries.inc(reason=kind)
+        return delay
+
+    def _attempt_timeout(self, deadline: float) -> float:
+        return max(0.001, min(GEMINI_ATTEMPT_TIMEOUT, deadline - time.monotonic()))
+
+    async def generate(self, prompt, deadline: float = GEMINI_DEADLINE):
+        # One non-streaming generate_content call with the full policy; returns the response
+        deadline = time.monotonic() + deadline
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            probe = await self._admit(deadline)
+            start = time.monotonic()
+            timeout = self._attempt_timeout(deadline)
+            try:
+                response = await asyncio.wait_for(
+                    self.get_model().generate_content_async(prompt, request_options={"timeout": timeout}), timeout
+                )
+                error = None
+            except Exception as e:
+                error = e
+            except BaseException:
+                self.breaker.abandon(probe)
+                raise
+            finally:
+                self.limiter.release()
+
+            if error is None:
+                self.limiter.on_success(time.monotonic() - start)
+                self.breaker.success()
+                return response
+            await asyncio.sleep(self._retry_delay(error, attempt, deadline))
+
+    def stream(self, prompt, deadline: float = GEMINI_DEADLINE):
+        return GeminiStream(self, prompt, deadline)
+
+
+class GeminiStream:
+    # async with client.stream(prompt) as response: async for chunk in response: ...
+    # Retries are only possible until the first chunk arrives; after that a failure ends the stream.
+    # The concurrency slot is held for the whole stream.
+    def __init__(self, client: GeminiClient, prompt, deadline: float):
+        self.client = client
+        self.prompt = prompt
+        self.deadline = deadline
+        self.response = None
+        self.first = None
+        self.probe = None
+
+    @property
+    def usage_metadata(self):
+        return self.response.usage_metadata
+
+    async def __aenter__(self):
+        client = self.client
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            self.probe = await client._admit(deadline)
+            start = time.monotonic()
+            timeout = client._attempt_timeout(deadline)
+            try:
+                self.response = await asyncio.wait_for(
+                    client.get_model().generate_content_async(self.prompt, stream=True, request_options={"timeout": timeout}), timeout
+                )
+                self.chunks = self.response.__aiter__()
+                self.first = await asyncio.wait_for(self.chunks.__anext__(), client._attempt_timeout(deadline))
+            except StopAsyncIteration:
+                self.first = None
+            except Exception as e:
+                client.limiter.release()
+                await asyncio.sleep(client._retry_delay(e, attempt, deadline))
+                continue
+            except BaseException:
+                client.limiter.release()
+                client.breaker.abandon(self.probe)
+                raise
+            client.limiter.on_success(time.monotonic() - start)
+            return self
+
+    async def __aiter__(self):
+        if self.first is None:
+            return
+        yield self.first
+        while True:
+            try:
+                chunk = await asyncio.wait_for(self.chunks.__anext__(), GEMINI_ATTEMPT_TIMEOUT)
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                if classify(e) is None:
+                    raise
+                self.client.breaker.failure()
+                raise GeminiUnavailable(f"Gemini stream failed ({classify(e)}): {e or type(e).__name__}", 1.0) from e
+            yield chunk
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.client.limiter.release()
+        if exc_type is None:
+            self.client.breaker.success()
+        else:
+            # Cancelled or failed mid-stream; a failure was already recorded in __aiter__
+            self.client.breaker.abandon(self.probe)
+        return False
@@ -1,10 +1,16 @@
 from dotenv import load_dotenv
-import google.generativeai as genai
+import hashlib
+import json
 import os
+import threading
+import time
+
+import metrics
+import prompt_builder
+from gemini_client import GeminiClient
 
 load_dotenv()
 gemini_api_key=os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=gemini_api_key)
 
 SYSTEM_PROMPT = """
 You are a clinical pharmacist assisting in post-prescription care. 
@@ -20,30 +26,95 @@ Escape all double quotes (\"). Use \\n for line breaks.
 Instructions:
 1. Identify potential interactions using the provided medication names and descriptions.
 2. Summarize what each medication does max 2 sentences.
-3. Explain any known or likely conflicts (e.g., duplicate mechanisms, metabolism issues, kidney risks).
+3. Explain any known or likely conflicts (e.g., duplicate mechanisms, metabolism issues, kidney risks). Items under "Precomputed Interaction Flags" come from class-based rules and can include false positives: check each one against the medications, explain the ones that apply in plain words, and briefly say so when one does not.
 4. Provide a safe medication schedule, including morning/evening timing and food instructions.
 
 
 Do NOT introduce medications not listed. This is post-prescription support, not diagnosis or prescription.
 """
 
-model = genai.GenerativeModel(
-    model_name="gemini-1.5-pro",
-    system_instruction=SYSTEM_PROMPT
-)
-
-def generate_medication_summary(medication_descriptions: str, profile: str) -> str:
-    chat = model.start_chat()
-    response = chat.send_message(f"""
+USER_PROMPT = """
 Medications and Definitions:
-{medication_descriptions}
-
+{medications}
+{interactions}
 Patient Profile:
 {profile}
 
 Please format your output using the structure described above.
-""")
-    return response.text
+"""
+INTERACTIONS_SECTION = "\nPrecomputed Interaction Flags (verify before explaining):\n{flags}\n"
+
+GEMINI_MODEL = "gemini-1.5-pro"
+# Changes whenever the model, either prompt, or the way prompt_builder renders and trims the
+# medication table does, so cached summaries from an older prompt are ignored
+PROMPT_VERSION = hashlib.sha256(json.dumps([
+    GEMINI_MODEL, SYSTEM_PROMPT, USER_PROMPT, INTERACTIONS_SECTION,
+    prompt_builder.FORMAT_VERSION, prompt_builder.TRIM_LEVELS, prompt_builder.PROMPT_TOKEN_BUDGET
+]).encode("utf-8")).hexdigest()[:16]
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    # The client library is slow to import, so it is configured on first use (or during warmup)
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=gemini_api_key)
+                _model = genai.GenerativeModel(
+                    model_name=GEMINI_MODEL,
+                    system_instruction=SYSTEM_PROMPT
+                )
+    return _model
+
+# Rate limiting, retries and circuit breaking for every call below
+gemini_client = GeminiClient(get_model)
+
+def build_prompt(medication_descriptions: str, profile: str, interactions: str = "") -> str:
+    known = INTERACTIONS_SECTION.format(flags=interactions) if interactions else ""
+    return USER_PROMPT.format(medications=medication_descriptions, interactions=known, profile=profile)
+
+def finish_reason(response) -> str:
+    # "STOP" when the model finished on its own; "MAX_TOKENS", "SAFETY", ... when it was cut off.
+    # Streamed chunks before the last one carry no reason.
+    candidates = getattr(response, "candidates", None)
+    reason = candidates[0].finish_reason if candidates else None
+    return getattr(reason, "name", str(reason)) if reason else ""
+
+# The request is awaited on the event loop. Returns (text, finish reason)
+async def generate_medication_summary_async(medication_descriptions: str, profile: str, interactions: str = ""):
+    with metrics.stage("gemini", model=GEMINI_MODEL) as span:
+        response = await gemini_client.generate(build_prompt(medication_descriptions, profile, interactions))
+        metrics.record_gemini_usage(response.usage_metadata, span)
+    return (response.text if response.parts else ""), finish_reason(response)
+
+# Streams the summary as it is generated: yields ("chunk", text) pieces, then one ("usage", {...})
+# that also carries the finish reason
+async def stream_medication_summary(medication_descriptions: str, profile: str, interactions: str = ""):
+    start = time.perf_counter()
+    first_chunk = True
+    reason = ""
+    async with gemini_client.stream(build_prompt(medication_descriptions, profile, interactions)) as response:
+        async for chunk in response:
+            reason = finish_reason(chunk) or reason
+            # The last chunk can carry only finish/usage info and no text parts
+            if chunk.parts:
+                if first_chunk:
+                    metrics.observe("gemini_first_chunk", time.perf_counter() - start)
+                    first_chunk = False
+                yield "chunk", chunk.text
+
+    metrics.observe("gemini_stream", time.perf_counter() - start)
+    usage = response.usage_metadata
+    metrics.record_gemini_usage(usage)
+    yield "usage", {
+        "prompt_tokens": usage.prompt_token_count,
+        "response_tokens": usage.candidates_token_count,
+        "total_tokens": usage.total_token_count,
+        "finish_reason": reason
+    }
 
 
 '''TEST passed'''
@@ -59,5 +130,5 @@ Please format your output using the structure described above.
 # Allergies: penicillin
 # """
 
-#     output = generate_medication_summary(sample_meds, sample_profile)
+#     output = asyncio.run(generate_medication_summary_async(sample_meds, sample_profile))
 #     print(output)
@@ -0,0 +1,33 @@
+import gc
+import os
+from dotenv import load_dotenv
+
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py backend:app
+# The app is imported once in the master and the model weights, catalog and local embedding
+# matrix are loaded there before the workers fork, so N workers share one copy of them instead
+# of loading N. Check with: python benchmarks/memory_report.py <master pid>
+
+load_dotenv()
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# The app reads this back to split per-process limits (the Gemini quota) between the workers
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+# PRELOAD_MODELS=0 gives every worker its own copy again (e.g. to compare memory)
+preload_app = os.getenv("PRELOAD_MODELS", "1") == "1"
+
+if preload_app:
+    # No collections in the master until the shared objects are frozen (see on_starting);
+    # collecting in between leaves freed holes that later allocations dirty in every worker
+    gc.disable()
+
+
+def on_starting(server):
+    if not preload_app:
+        return
+    from pinecone_query import preload_shared_resources
+    preload_shared_resources()
+
+def post_fork(server, worker):
+    gc.enable()
@@ -0,0 +1,340 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from itertools import combinations
+from dotenv import load_dotenv
+
+from drug_catalog import DRUGS_CSV, MISSING, load_catalog
+
+# Precomputed, deterministic interaction checks built from the catalog's drug_class, alcohol,
+# pregnancy and csa columns. Every drug gets three bitmasks:
+#   groups    - pharmacological groups its class belongs to (NSAID, opioid, SSRI, ...)
+#   conflicts - OR of every group that conflicts with one of its groups
+#   flags     - per-drug risk flags (alcohol, CNS depressant, pregnancy X, controlled, ...)
+# so checking a regimen is a handful of integer ANDs per pair of drugs.
+#
+# Built offline (or on first start when the file is missing):
+#   python interactions.py build
+#   python interactions.py check warfarin ibuprofen "ethinyl estradiol"
+
+load_dotenv()
+INTERACTIONS_FILE = os.getenv("INTERACTIONS_FILE", "interactions.json")
+FORMAT_VERSION = 2
+
+# Group -> pattern matched against the (lowercased) drug_class text. A class can be in several groups.
+# Catalog classes are broad ("antianginal agents", "antimigraine agents", "antihistamines"), so
+# groups that only cover part of such a class are matched on the generic name instead (NAME_GROUPS).
+GROUPS = {
+    "nsaid": r"nonsteroidal anti-?inflammatory|\bnsaid|cox-2 inhibitor",
+    "anticoagulant": r"coumarin|anticoagulant|factor xa inhibitor|thrombin inhibitor|heparin",
+    "antiplatelet": r"platelet aggregation inhibitor|antiplatelet",
+    "ace_inhibitor": r"angiotensin converting enzyme",
+    "arb": r"angiotensin (ii )?receptor (blocker|antagonist)",
+    "potassium_sparing": r"potassium-sparing|potassium sparing|aldosterone",
+    "ssri": r"\bssri|selective serotonin reuptake",
+    "snri": r"\bsnri|serotonin-norepinephrine reuptake",
+    "maoi": r"monoamine oxidase",
+    "tricyclic": r"tricyclic",
+    "triptan": r"triptan",
+    "opioid": r"narcotic analgesic|opioid(?! antagonist)",
+    "benzodiazepine": r"benzodiazepine",
+    "barbiturate": r"barbiturate",
+    "sedative": r"sedatives|hypnotic",
+    "muscle_relaxant": r"skeletal muscle relaxant",
+    "antipsychotic": r"antipsychotic",
+    "gabapentinoid": r"gamma-aminobutyric acid analog",
+    "statin": r"hmg-coa reductase|\bstatin",
+    "macrolide": r"macrolide",
+    "azole_antifungal": r"azole antifungal",
+    "nitrate": r"\bnitrates?\b",
+    "pde5_inhibitor": r"impotence agent|phosphodiesterase-5|pde-5",
+}
+# Group -> pattern matched against the generic name
+NAME_GROUPS = {
+    "triptan": r"triptan\b",
+    "nitrate": r"nitroglycerin|isosorbide|amyl nitrite",
+    # Second-generation antihistamines (loratadine, fexofenadine, ...) are not sedating
+    "sedating_antihistamine": r"diphenhydramine|doxylamine|hydroxyzine|promethazine|chlorpheniramine|"
+                              r"brompheniramine|meclizine|cyproheptadine|dimenhydrinate|carbinoxamine|"
+                              r"clemastine|triprolidine",
+}
+GROUP_NAMES = list(dict.fromkeys([*GROUPS, *NAME_GROUPS]))
+GROUP_BIT = {name: 1 << i for i, name in enumerate(GROUP_NAMES)}
+GROUP_PATTERNS = [(GROUP_BIT[name], re.compile(pattern)) for name, pattern in GROUPS.items()]
+NAME_PATTERNS = [(GROUP_BIT[name], re.compile(pattern)) for name, pattern in NAME_GROUPS.items()]
+
+# Class-pair conflict table: (group, group, severity, reason)
+CONFLICTS = [
+    ("nsaid", "anticoagulant", "major", "Increased bleeding risk."),
+    ("antiplatelet", "anticoagulant", "major", "Increased bleeding risk."),
+    ("nsaid", "antiplatelet", "moderate", "Increased bleeding risk, especially in the stomach."),
+    ("nsaid", "ace_inhibitor", "moderate", "NSAIDs can blunt the blood pressure effect and strain the kidneys."),
+    ("nsaid", "arb", "moderate", "NSAIDs can blunt the blood pressure effect and strain the kidneys."),
+    ("ace_inhibitor", "potassium_sparing", "major", "Risk of high potassium levels."),
+    ("arb", "potassium_sparing", "major", "Risk of high potassium levels."),
+    ("ace_inhibitor", "arb", "major", "Double blockade of the renin-angiotensin system (kidney injury, high potassium)."),
+    ("opioid", "benzodiazepine", "major", "Combined sedation can slow or stop breathing."),
+    ("maoi", "ssri", "major", "Risk of serotonin syndrome."),
+    ("maoi", "snri", "major", "Risk of serotonin syndrome."),
+    ("maoi", "tricyclic", "major", "Risk of serotonin syndrome and dangerous blood pressure changes."),
+    ("maoi", "triptan", "major", "Risk of serotonin syndrome."),
+    ("ssri", "triptan", "moderate", "Risk of serotonin syndrome."),
+    ("snri", "triptan", "moderate", "Risk of serotonin syndrome."),
+    ("statin", "macrolide", "moderate", "Higher statin levels; risk of muscle damage."),
+    ("statin", "azole_antifungal", "moderate", "Higher statin levels; risk of muscle damage."),
+    ("nitrate", "pde5_inhibitor", "major", "Severe drop in blood pressure."),
+]
+CONFLICT_INFO = {}
+for a, b, severity, reason in CONFLICTS:
+    CONFLICT_INFO[(GROUP_BIT[a], GROUP_BIT[b])] = CONFLICT_INFO[(GROUP_BIT[b], GROUP_BIT[a])] = (severity, reason)
+
+CNS_DEPRESSANTS = GROUP_BIT["opioid"] | GROUP_BIT["benzodiazepine"] | GROUP_BIT["barbiturate"] | GROUP_BIT["sedative"] \
+    | GROUP_BIT["muscle_relaxant"] | GROUP_BIT["antipsychotic"] | GROUP_BIT["gabapentinoid"] \
+    | GROUP_BIT["sedating_antihistamine"]
+SEROTONERGIC = GROUP_BIT["ssri"] | GROUP_BIT["snri"] | GROUP_BIT["maoi"] | GROUP_BIT["tricyclic"] | GROUP_BIT["triptan"]
+
+# Per-drug flags
+ALCOHOL = 1 << 0
+CNS_DEPRESSANT = 1 << 1
+SEROTONERGIC_DRUG = 1 << 2
+PREGNANCY_X = 1 << 3
+PREGNANCY_D = 1 << 4
+CONTROLLED = 1 << 5
+SCHEDULE_II = 1 << 6
+
+
+def groups_for(drug_class: str, generic_name: str) -> int:
+    text = drug_class.lower()
+    mask = 0
+    for bit, pattern in GROUP_PATTERNS:
+        if pattern.search(text):
+            mask |= bit
+    for bit, pattern in NAME_PATTERNS:
+        if pattern.search(generic_name):
+            mask |= bit
+    return mask
+
+def conflict_mask(groups: int) -> int:
+    mask = 0
+    for (a, b) in CONFLICT_INFO:
+        if groups & a:
+            mask |= b
+    return mask
+
+def drug_flags(groups: int, alcohol: str, pregnancy: str, csa: str) -> int:
+    flags = 0
+    if alcohol == "X":
+        flags |= ALCOHOL
+    if groups & CNS_DEPRESSANTS:
+        flags |= CNS_DEPRESSANT
+    if groups & SEROTONERGIC:
+        flags |= SEROTONERGIC_DRUG
+    if pregnancy == "X":
+        flags |= PREGNANCY_X
+    elif pregnancy == "D":
+        flags |= PREGNANCY_D
+    if csa in ("1", "2", "3", "4", "5", "M"):
+        flags |= CONTROLLED
+    if csa in ("1", "2"):
+        flags |= SCHEDULE_II
+    return flags
+
+def split_bits(mask: int):
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
+
+
+def build(catalog) -> dict:
+    # One entry per generic name: [class id, groups, conflicts, flags]. Names that appear in
+    # several rows (combination products) get the union of their masks.
+    classes = {}
+    drugs = {}
+    for i in range(len(catalog)):
+        drug_class = catalog.drug_class[i]
+        class_id = classes.setdefault(drug_class, len(classes)) if drug_class != MISSING else -1
+        groups = groups_for(drug_class, catalog.generic_name[i])
+        flags = drug_flags(groups, catalog.alcohol[i], catalog.pregnancy[i], catalog.csa[i])
+
+        entry = drugs.get(catalog.generic_name[i])
+        if entry is None:
+            drugs[catalog.generic_name[i]] = [class_id, groups, conflict_mask(groups), flags]
+        else:
+            entry[1] |= groups
+            entry[2] |= conflict_mask(groups)
+            entry[3] |= flags
+
+    brands = {}
+    for brand, ids in catalog.brand_index.items():
+        if brand not in drugs:
+            brands[brand] = catalog.generic_name[ids[0]]
+
+    return {
+        "format": FORMAT_VERSION,
+        # Changes whenever the rules do, so a stale file gets rebuilt
+        "rules": rules_hash(),
+        # Changes whenever drugs.csv does, so new drugs and changed flags are picked up
+        "catalog": catalog_fingerprint(catalog),
+        "classes": list(classes),
+        "drugs": drugs,
+        "brands": brands,
+    }
+
+def rules_hash() -> str:
+    rules = json.dumps([GROUPS, NAME_GROUPS, CONFLICTS], sort_keys=True)
+    return hashlib.sha256(rules.encode("utf-8")).hexdigest()[:16]
+
+
+def catalog_fingerprint(catalog) -> str:
+    # Hash of every column the table is built from
+    digest = hashlib.sha256()
+    for column in (catalog.generic_name, catalog.drug_class, catalog.alcohol, catalog.pregnancy, catalog.csa, catalog.brand_names):
+        digest.update("\x1f".join(column).encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.hexdigest()[:16]
+
+
+class InteractionIndex:
+    def __init__(self, data: dict):
+        self.classes = data["classes"]
+        self.drugs = data["drugs"]
+        self.brands = data["brands"]
+        self.version = data["rules"]
+
+    @classmethod
+    def load(cls, path: str = INTERACTIONS_FILE, catalog=None):
+        # With a catalog, the file must also have been built from that catalog
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != FORMAT_VERSION or data.get("rules") != rules_hash():
+            raise ValueError(f"{path} was built with different rules; rebuild it")
+        if catalog is not None and data.get("catalog") != catalog_fingerprint(catalog):
+            raise ValueError(f"{path} was built from a different drugs.csv; rebuild it")
+        return cls(data)
+
+    def resolve(self, name: str):
+        # (generic name, entry) for a generic or brand name, or (None, None)
+        key = name.strip().lower()
+        generic = key if key in self.drugs else self.brands.get(key)
+        if generic is None:
+            # OCR'd names often carry a strength or form after the drug name
+            first = key.split(" ", 1)[0]
+            generic = first if first in self.drugs else self.brands.get(first)
+        return (generic, self.drugs[generic]) if generic else (None, None)
+
+    def check(self, names: list[str]) -> dict:
+        meds = []
+        unknown = []
+        seen = set()
+        for name in names:
+            generic, entry = self.resolve(name)
+            if generic is None:
+                unknown.append(name)
+            elif generic not in seen:
+                seen.add(generic)
+                meds.append((name, *entry))
+
+        conflicts = []
+        duplicates = []
+        for (name_a, class_a, groups_a, conflicts_a, _), (name_b, class_b, groups_b, _, _) in combinations(meds, 2):
+            if class_a != -1 and class_a == class_b:
+                duplicates.append({"drugs": [name_a, name_b], "drug_class": self.classes[class_a]})
+            hits = conflicts_a & groups_b
+            for bit_b in split_bits(hits):
+                for bit_a in split_bits(groups_a):
+                    info = CONFLICT_INFO.get((bit_a, bit_b))
+                    if info:
+                        conflicts.append({
+                            "drugs": [name_a, name_b],
+                            "groups": [GROUP_NAMES[bit_a.bit_length() - 1], GROUP_NAMES[bit_b.bit_length() - 1]],
+                            "severity": info[0],
+                            "reason": info[1],
+                        })
+
+        flagged = lambda flag: [name for name, _, _, _, flags in meds if flags & flag]
+        cns = flagged(CNS_DEPRESSANT)
+        serotonergic = flagged(SEROTONERGIC_DRUG)
+        alcohol = flagged(ALCOHOL)
+        controlled = flagged(CONTROLLED)
+
+        warnings = []
+        if len(cns) > 1:
+            warnings.append({"flag": "cns_depressant_stacking", "drugs": cns, "severity": "major",
+                             "reason": "Several sedating medications together add up to drowsiness and slowed breathing."})
+        if len(serotonergic) > 1:
+            warnings.append({"flag": "serotonergic_stacking", "drugs": serotonergic, "severity": "moderate",
+                             "reason": "Several serotonergic medications together raise the risk of serotonin syndrome."})
+        if alcohol:
+            warnings.append({"flag": "alcohol", "drugs": alcohol, "severity": "moderate" if not cns else "major",
+                             "reason": "Avoid alcohol with these medications."})
+        if flagged(PREGNANCY_X):
+            warnings.append({"flag": "pregnancy_x", "drugs": flagged(PREGNANCY_X), "severity": "major",
+                             "reason": "Must not be used during pregnancy."})
+        if flagged(PREGNANCY_D):
+            warnings.append({"flag": "pregnancy_d", "drugs": flagged(PREGNANCY_D), "severity": "moderate",
+                             "reason": "Evidence of fetal risk; discuss with a doctor if pregnant."})
+        if len(controlled) > 1:
+            warnings.append({"flag": "multiple_controlled", "drugs": controlled, "severity": "moderate",
+                             "reason": "More than one controlled substance."})
+
+        return {"conflicts": conflicts, "duplicates": duplicates, "warnings": warnings, "unknown": unknown}
+
+
+def format_for_prompt(result: dict) -> str:
+    # Compact lines for Gemini; empty when nothing was flagged
+    lines = [f"- {' + '.join(c['drugs'])} ({c['severity']}): {c['reason']}" for c in result["conflicts"]]
+    lines += [f"- {' + '.join(d['drugs'])} (duplicate class {d['drug_class']})" for d in result["duplicates"]]
+    lines += [f"- {', '.join(w['drugs'])} ({w['severity']}): {w['reason']}" for w in result["warnings"]]
+    return "\n".join(lines)
+
+def load_or_build(catalog, path: str = INTERACTIONS_FILE):
+    # Prebuilt file when it is current, otherwise build from the catalog (and save it for next time)
+    if os.path.exists(path):
+        try:
+            return InteractionIndex.load(path, catalog)
+        except (ValueError, KeyError, json.JSONDecodeError) as e:
+            print(f"[Interactions] {e}")
+    if catalog is None:
+        print("[Interactions] No catalog loaded, interaction flags are off")
+        return None
+    data = build(catalog)
+    save(data, path)
+    return InteractionIndex(data)
+
+def save(data: dict, path: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the precomputed interaction table")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build")
+    build_cmd.add_argument("--csv", default=DRUGS_CSV)
+    build_cmd.add_argument("--out", default=INTERACTIONS_FILE)
+    check_cmd = sub.add_parser("check")
+    check_cmd.add_argument("names", nargs="+")
+    check_cmd.add_argument("--file", default=INTERACTIONS_FILE)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        catalog = load_catalog(args.csv)
+        if catalog is None:
+            sys.exit(1)
+        data = build(catalog)
+        save(data, args.out)
+        flagged = sum(1 for entry in data["drugs"].values() if entry[1] or entry[3])
+        print(f"Wrote {args.out}: {len(data['drugs'])} drugs ({flagged} with groups or flags), {len(data['classes'])} classes")
+    else:
+        result = InteractionIndex.load(args.file).check(args.names)
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
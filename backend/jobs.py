@@ -0,0 +1,189 @@
+import asyncio
+import json
+from contextlib import contextmanager
+import os
+import sqlite3
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Durable background job queue for uploads, backed by a local SQLite file.
+# No broker: every API worker process runs a few async consumers against the same file.
+# A claimed job holds a lease; if its worker dies, the job becomes claimable again once the lease expires.
+
+load_dotenv()
+JOBS_DB = os.getenv("JOBS_DB", "jobs.sqlite3")
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# A failed attempt is retried after JOB_RETRY_SECONDS, doubling with each attempt
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "30"))
+JOB_POLL_SECONDS = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT,
+    leased_until REAL,
+    not_before REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        self.wakeup = asyncio.Event()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Files created before retries were delayed
+            if "not_before" not in [col["name"] for col in conn.execute("PRAGMA table_info(jobs)")]:
+                try:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+                except sqlite3.OperationalError:
+                    pass # another worker added it first
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit connection per call; WAL lets readers (status checks) run alongside claims
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    # --- blocking primitives (run in a thread from async code) ---
+
+    def _enqueue(self, kind: str, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, stage, created_at, updated_at) VALUES (?, ?, ?, 'queued', 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now)
+            )
+        return job_id
+
+    def _claim(self):
+        # (job, lost): the oldest queued job, or a running one whose worker stopped renewing its
+        # lease; and the jobs given up on because their worker died on the last attempt
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            lost = [self._row_to_job(row) for row in conn.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND leased_until < ? AND attempts >= ?",
+                (now, JOB_MAX_ATTEMPTS)
+            )]
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = 'worker lost', updated_at = ? WHERE id = ?",
+                [(now, job["id"]) for job in lost]
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND (not_before IS NULL OR not_before <= ?)) "
+                "OR (status = 'running' AND leased_until < ?) ORDER BY created_at LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None, lost
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, leased_until = ?, updated_at = ? WHERE id = ?",
+                (now + JOB_LEASE_SECONDS, now, row["id"])
+            )
+            conn.execute("COMMIT")
+        job = self._row_to_job(row)
+        job["attempts"] += 1
+        return job, lost
+
+    def _row_to_job(self, row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _update(self, job_id: str, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], default=str)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _get(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    # --- async API ---
+
+    async def enqueue(self, kind: str, payload: dict) -> str:
+        job_id = await asyncio.to_thread(self._enqueue, kind, payload)
+        self.wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str):
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def set_stage(self, job_id: str, stage: str):
+        await asyncio.to_thread(self._update, job_id, stage=stage, leased_until=time.time() + JOB_LEASE_SECONDS)
+
+    async def worker(self, handlers: dict, on_final: dict):
+        # handlers: kind -> async fn(queue, job) returning a JSON-serializable result
+        # on_final: kind -> fn(job), run once the job is done or has failed for good
+        while True:
+            try:
+                await self._work_once(handlers, on_final)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. "database is locked" while other workers hold the file; keep this consumer alive
+                print(f"[Jobs] Worker error: {e}")
+                await asyncio.sleep(JOB_POLL_SECONDS)
+
+    async def _work_once(self, handlers: dict, on_final: dict):
+        job, lost = await asyncio.to_thread(self._claim)
+        for lost_job in lost:
+            await self._finalize(on_final, lost_job)
+        if job is None:
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        try:
+            result = await handlers[job["kind"]](self, job)
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back instead of losing it
+            await asyncio.to_thread(self._update, job["id"], status="queued", leased_until=None, not_before=None)
+            raise
+        except Exception as e:
+            print(f"[Jobs] {job['kind']} job {job['id']} failed (attempt {job['attempts']}): {e}")
+            status = "failed" if job["attempts"] >= JOB_MAX_ATTEMPTS else "queued"
+            retry_at = time.time() + JOB_RETRY_SECONDS * 2 ** (job["attempts"] - 1)
+            await asyncio.to_thread(self._update, job["id"], status=status, error=str(e), leased_until=None, not_before=retry_at)
+        else:
+            # If this write fails the lease runs out and the job is redone; handlers are idempotent
+            await asyncio.to_thread(self._update, job["id"], status="done", stage="done", result=result, error=None, leased_until=None)
+            status = "done"
+        if status in ("done", "failed"):
+            await self._finalize(on_final, job)
+
+    async def _finalize(self, on_final: dict, job: dict):
+        if job["kind"] in on_final:
+            await asyncio.to_thread(on_final[job["kind"]], job)
+
+    def start(self, handlers: dict, workers: int = UPLOAD_JOB_WORKERS, on_final: dict = None):
+        return [asyncio.create_task(self.worker(handlers, on_final or {})) for _ in range(workers)]
@@ -0,0 +1,269 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# In-process metrics for each stage of a request (embedding, vector query, Gemini, Mongo, OCR).
+# - /metrics renders everything in the Prometheus text format
+# - every response gets a Server-Timing header with the stages that ran for it
+# - with OTEL_TRACES_FILE set (and opentelemetry-sdk installed) each stage is also a span,
+#   written as JSON lines to that file
+# Values are per process; with several workers, scrape each one (or sum them) like any Python exporter.
+
+load_dotenv()
+OTEL_TRACES_FILE = os.getenv("OTEL_TRACES_FILE")
+SERVICE_NAME = "rxcheck-api"
+
+# Seconds; covers a cached lookup (~1 ms) up to a long Gemini generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self):
+        yield f"{self.name} {_format_value(self.value)}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # labels -> [per-bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        slot = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            series[slot] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.values.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-1])}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+REGISTRY = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+stage_seconds = register(Histogram("rxcheck_stage_duration_seconds", "Time spent in each backend stage.", ["stage"]))
+stage_errors = register(Counter("rxcheck_stage_errors_total", "Stages that raised an exception.", ["stage"]))
+request_seconds = register(Histogram("rxcheck_http_request_duration_seconds", "HTTP request latency.", ["method", "route", "status"]))
+embedded_texts = register(Counter("rxcheck_embedded_texts_total", "Texts run through the embedding model (cache misses)."))
+gemini_tokens = register(Counter("rxcheck_gemini_tokens_total", "Gemini tokens used.", ["kind"]))
+gemini_call_tokens = register(Histogram("rxcheck_gemini_call_tokens", "Tokens per Gemini call.", ["kind"], TOKEN_BUCKETS))
+prompt_tokens_estimated = register(Histogram("rxcheck_prompt_tokens_estimated", "Estimated user-prompt tokens after budgeting.", buckets=TOKEN_BUCKETS))
+prompt_trim_levels = register(Counter("rxcheck_prompt_trim_total", "Prompts by how much the medication section was trimmed.", ["level"]))
+coalesced_calls = register(Counter("rxcheck_coalesced_calls_total", "Calls that joined an identical call already in flight.", ["flight"]))
+gemini_retries = register(Counter("rxcheck_gemini_retries_total", "Gemini calls retried, by failure kind.", ["reason"]))
+gemini_rejected = register(Counter("rxcheck_gemini_rejected_total", "Gemini calls given up on or refused locally.", ["reason"]))
+gemini_concurrency_limit = register(Gauge("rxcheck_gemini_concurrency_limit", "Current adaptive limit on concurrent Gemini calls."))
+gemini_breaker_state = register(Gauge("rxcheck_gemini_circuit_state", "Gemini circuit breaker: 0 closed, 1 half-open, 2 open."))
+pdf_pages = register(Counter("rxcheck_pdf_pages_total", "PDF pages read, by how their text was obtained.", ["source"]))
+
+
+# --- tracing (optional) ---
+
+# Set by init_tracing() in each serving process (from the app's lifespan), never at import:
+# the span exporter's thread would not survive a gunicorn preload fork, and the OCR worker
+# processes import this module too.
+tracer = None
+_tracer_provider = None
+
+def init_tracing(path: str = OTEL_TRACES_FILE):
+    global tracer, _tracer_provider
+    if tracer is not None or not path:
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        print("[Metrics] OTEL_TRACES_FILE is set but opentelemetry-sdk is not installed; tracing is off")
+        return
+
+    out = open(path, "a", buffering=1)
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+    exporter = ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    print(f"[Metrics] Writing trace spans to {path}")
+    _tracer_provider = provider
+    tracer = trace.get_tracer(SERVICE_NAME)
+
+def shutdown_tracing():
+    # Flushes spans still queued in the exporter
+    global tracer, _tracer_provider
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+    tracer = _tracer_provider = None
+
+@contextmanager
+def _span(name: str, attributes: dict):
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as span:
+        yield span
+
+
+# --- per-request stage timings (Server-Timing) ---
+
+# The list of (stage, seconds) for the request being handled. asyncio tasks and
+# asyncio.to_thread inherit it; executor calls need copy_context (see pinecone_query.run_in).
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def observe(name: str, seconds: float):
+    stage_seconds.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+@contextmanager
+def stage(name: str, **attributes):
+    start = time.perf_counter()
+    with _span(name, attributes) as span:
+        try:
+            yield span
+        except Exception:
+            stage_errors.inc(stage=name)
+            raise
+        finally:
+            observe(name, time.perf_counter() - start)
+
+def record_gemini_usage(usage, span=None):
+    # usage is the response's usage_metadata
+    counts = {
+        "prompt": getattr(usage, "prompt_token_count", 0) or 0,
+        "response": getattr(usage, "candidates_token_count", 0) or 0,
+    }
+    for kind, count in counts.items():
+        gemini_tokens.inc(count, kind=kind)
+        gemini_call_tokens.observe(count, kind=kind)
+        if span is not None:
+            span.set_attribute(f"gemini.{kind}_tokens", count)
+
+def server_timing(timings, total: float) -> str:
+    # Repeated stages (e.g. several Mongo calls) are summed into one entry with a count
+    totals = {}
+    for name, seconds in timings:
+        spent, count = totals.get(name, (0.0, 0))
+        totals[name] = (spent + seconds, count + 1)
+    entries = [
+        f'{name.replace(".", "-")};dur={spent * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+        for name, (spent, count) in totals.items()
+    ]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (so streaming responses pass straight through): times every
+    # HTTP request, collects its stage timings and adds them as a Server-Timing header.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = []
+        token = _request_timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(timings, time.perf_counter() - start)
+                message["headers"] = [*message.get("headers", []), (b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            with _span(f"{scope['method']} {scope['path']}", {"http.method": scope["method"], "http.target": scope["path"]}) as span:
+                await self.app(scope, receive, send_with_timing)
+                if span is not None:
+                    span.set_attribute("http.status_code", status)
+        finally:
+            _request_timings.reset(token)
+            # Label by route template, not the raw path, so user ids don't create new series
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            request_seconds.observe(time.perf_counter() - start, method=scope["method"], route=route, status=str(status))
@@ -1,69 +1,198 @@
-from pdf2image import convert_from_path
-import pytesseract
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+import os
 import re
+import time
 
-
+from dotenv import load_dotenv
 from pypdf import PdfReader
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 
-def extract_text_from_pdf(file_path: str, page_limit: int = -1) -> str:
-    # Try extracting with PyPDF (for text-based PDFs)
+import metrics
+
+load_dotenv()
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "1") == "1"
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+
+_ocr_pool = None
+
+def get_ocr_pool():
+    # Tesseract is CPU-bound, so pages are OCR'd in separate processes.
+    # spawn keeps the workers free of the parent's threads (torch, event loop).
+    global _ocr_pool
+    if _ocr_pool is None:
+        _ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _ocr_pool
+
+def ocr_page(file_path: str, page_number: int, dpi: int = OCR_DPI, grayscale: bool = OCR_GRAYSCALE) -> str:
+    # Renders just this page (1-based), so only one page image is in memory per worker
+    try:
+        images = convert_from_path(file_path, dpi=dpi, grayscale=grayscale, first_page=page_number, last_page=page_number)
+        return "\n".join(pytesseract.image_to_string(img) for img in images)
+    except Exception as e:
+        print(f"[OCR] Error extracting text via OCR on page {page_number}: {e}")
+        return ""
+
+def _ocr_page_timed(file_path: str, page_number: int, dpi: int, grayscale: bool):
+    # Runs in the OCR worker process; the time is reported back so the API process can record it
+    start = time.perf_counter()
+    text = ocr_page(file_path, page_number, dpi, grayscale)
+    return text, time.perf_counter() - start
+
+def iter_pdf_text(file_path: str, page_limit: int = -1, dpi: int = OCR_DPI, grayscale: bool = OCR_GRAYSCALE, pool=None):
+    # Yields each page's text in order. Pages with a text layer come straight from PyPDF;
+    # only pages without one are rendered and OCR'd, in parallel, while earlier pages stream out.
+    pool = pool or get_ocr_pool()
+    pending = deque()
+    pages_seen = 0
+
     try:
         reader = PdfReader(file_path)
         pages = reader.pages[:page_limit] if page_limit > 0 else reader.pages
-        text = "\n".join(page.extract_text() or "" for page in pages)
-
-        if text.strip():  # If there's any readable text, use it
-            return text
+        for page_number, page in enumerate(pages, start=1):
+            pages_seen = page_number
+            try:
+                text = page.extract_text() or ""
+            except Exception as e:
+                print(f"[PyPDF] Error extracting text on page {page_number}: {e}")
+                text = ""
+            pending.append(text if text.strip() else pool.submit(_ocr_page_timed, file_path, page_number, dpi, grayscale))
+            while pending and (isinstance(pending[0], str) or pending[0].done()):
+                yield _page_text(pending.popleft())
     except Exception as e:
         print(f"[PyPDF] Error extracting text: {e}")
-
-    # Fallback to OCR
-    try:
-        images = convert_from_path(file_path)
+        # PyPDF can't read (the rest of) the file: OCR the remaining pages within the limit
+        try:
+            page_count = pdfinfo_from_path(file_path)["Pages"]
+        except Exception as e:
+            print(f"[OCR] Error reading page count: {e}")
+            page_count = 0
         if page_limit > 0:
-            images = images[:page_limit]
-        text = "\n".join(pytesseract.image_to_string(img) for img in images)
-        return text
-    except Exception as e:
-        print(f"[OCR] Error extracting text via OCR: {e}")
-        return ""
+            page_count = min(page_count, page_limit)
+        for page_number in range(pages_seen + 1, page_count + 1):
+            pending.append(pool.submit(_ocr_page_timed, file_path, page_number, dpi, grayscale))
 
+    while pending:
+        yield _page_text(pending.popleft())
 
-import re
-from typing import List
+def _page_text(item) -> str:
+    if isinstance(item, str):
+        metrics.pdf_pages.inc(source="text_layer")
+        return item
+    text, seconds = item.result()
+    metrics.pdf_pages.inc(source="ocr")
+    metrics.observe("ocr_page", seconds)
+    return text
+
+def extract_text_from_pdf(file_path: str, page_limit: int = -1) -> str:
+    return "\n".join(iter_pdf_text(file_path, page_limit))
+
+
+from datetime import date, datetime
+
+# Prescription line grammar. Everything is compiled once at import; each line is scanned
+# by one ignore-keyword alternation and one anchored medication pattern, so parsing is
+# linear in the size of the OCR dump.
+
+IGNORE_KEYWORDS = [
+    "Prophylactic", "Route Given", "Patient identification", "Dose Route", "instructions",
+    "Date of admission", "Date of planned discharge", "Chart Number", "Consultant", "DOB", "Ward",
+    "This prescription sheet", "Terms and Conditions", "Downloaded from"
+]
+# Longest keywords first so overlapping ones ("Date of planned discharge") match as a whole;
+# whole words only, so "DOB" doesn't drop "Dobutamine" and "Ward" doesn't match "Edward"
+IGNORE_RE = re.compile(
+    r"\b(?:" + "|".join(re.escape(k) for k in sorted(IGNORE_KEYWORDS, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE
+)
+
+UNITS = r"mcg|µg|mg|g|ml|units?|iu|mmol|%"
+MED_LINE_RE = re.compile(
+    r"^(?:[-*•]\s*|\d{1,3}[.)]\s+)?"                                   # optional bullet / list number
+    r"(?:(?:tab(?:let)?s?|cap(?:sule)?s?|inj(?:ection)?)\.?\s+)?"        # dosage-form prefix, not part of the name
+    r"(?P<name>[A-Za-z][A-Za-z'/-]*(?:\s+[A-Za-z][A-Za-z'/-]*){0,3}?)"
+    r"\s+(?P<dose>\d+(?:\.\d+)?)\s*(?P<unit>" + UNITS + r")(?![A-Za-z])",
+    re.IGNORECASE
+)
+ROUTE_RE = re.compile(
+    r"\b(oral(?:ly)?|po|iv|im|sc|sl|pr|subcut(?:aneous)?|intravenous|intramuscular|topical|inhaled|sublingual|rectal)\b",
+    re.IGNORECASE
+)
+FREQUENCY_RE = re.compile(
+    r"\b(once daily|twice daily|three times daily|four times daily|every \d+ hours|q\d+h|"
+    r"od|bd|bid|tds|tid|qds|qid|qhs|nocte|mane|prn|as needed|daily|weekly|at night)\b",
+    re.IGNORECASE
+)
+REFILLS_RE = re.compile(r"\brefills?\s*[:#]?\s*(\d+)", re.IGNORECASE)
+DATE_RE = re.compile(r"\b(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{2,4})\b")
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d/%m/%y", "%m/%d/%Y", "%m/%d/%y")
 
-def parse_prescription(text: str) -> dict:
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
 
-    ignore_keywords = [
-        "Prophylactic", "Route Given", "Patient identification", "Dose Route", "instructions",
-        "Date of admission", "Date of planned discharge", "Chart Number", "Consultant", "DOB", "Ward",
-        "This prescription sheet", "Terms and Conditions", "Downloaded from"
-    ]
-    cleaned_lines = [line for line in lines if not any(k.lower() in line.lower() for k in ignore_keywords)]
+def _iso_date(raw: str):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
 
+def _find_date(line: str):
+    m = DATE_RE.search(line)
+    return _iso_date(m.group(1)) if m else None
+
+def parse_prescription(text: str) -> dict:
     prescriptions = []
+    doc_date = None
+    doc_refills = None
+
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+
+        # Header/boilerplate lines; their dates are admission dates, DOBs etc., so skip them entirely
+        if IGNORE_RE.search(line):
+            continue
 
-    for line in cleaned_lines:
-        tokens = line.split()
-        if len(tokens) >= 3:
-            # Check if second token looks like a dosage (e.g., 10 mg, 1.5 g)
-            dose_match = re.match(r"^\d+(\.\d+)?(mg|g|ml|mcg)$", tokens[1] + tokens[2] if len(tokens) > 2 else tokens[1], re.IGNORECASE)
-            if dose_match:
-                name = tokens[0]
-                strength = tokens[1] + " " + tokens[2]
-                prescriptions.append({
-                    "pres_name": name,
-                    "pres_strength": strength,
-                    "active": True
-                })
+        refills = REFILLS_RE.search(line)
+        line_date = _find_date(line)
+        med = MED_LINE_RE.match(line)
+
+        if med is None:
+            # Document-level fields on their own lines, e.g. "Refills: 2" or "Date: 04/04/2025"
+            if refills and doc_refills is None:
+                doc_refills = int(refills.group(1))
+            if line_date and doc_date is None:
+                doc_date = line_date
+            continue
+
+        rest = line[med.end():]
+        route = ROUTE_RE.search(rest)
+        frequency = FREQUENCY_RE.search(rest)
+        prescriptions.append({
+            "pres_name": med.group("name"),
+            "pres_strength": f"{med.group('dose')} {med.group('unit').lower()}",
+            "route": route.group(1).lower() if route else None,
+            "frequency": frequency.group(1).lower() if frequency else None,
+            "refills": int(refills.group(1)) if refills else None,
+            "date_prescribed": line_date,
+            "active": True
+        })
+
+    doc_date = doc_date or date.today().isoformat()
+    doc_refills = doc_refills or 0
+    for med in prescriptions:
+        if med["refills"] is None:
+            med["refills"] = doc_refills
+        if med["date_prescribed"] is None:
+            med["date_prescribed"] = doc_date
 
     return {
         "prescriptions": prescriptions,
-        "date_prescribed": "2025-04-04",
+        "date_prescribed": doc_date,
         "family_member_name": "Unknown",
-        "num_refills": 0
+        "num_refills": doc_refills
     }
-
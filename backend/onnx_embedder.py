@@ -0,0 +1,144 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+from dotenv import load_dotenv
+
+# ONNX Runtime version of all-MiniLM-L6-v2 for query embedding, so workers don't need torch.
+# Mirrors the SentenceTransformer pipeline: tokenize -> transformer -> mean pooling -> L2 normalize.
+#
+# One-time build (needs torch + transformers, e.g. on a build machine):
+#   python onnx_embedder.py export --quantize
+# Check it against the torch model before switching EMBED_BACKEND=onnx:
+#   python onnx_embedder.py parity
+
+load_dotenv()
+MODEL_NAME = "all-MiniLM-L6-v2"
+HF_MODEL_ID = f"sentence-transformers/{MODEL_NAME}"
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_model")
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "1") == "1"
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0")) # 0 = derive from CPU count
+MAX_SEQ_LENGTH = 256 # same as the SentenceTransformer config for this model
+PARITY_THRESHOLD = 0.99
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"
+
+
+class OnnxEmbedder:
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, quantized: bool = ONNX_QUANTIZED, intra_op_threads: int = ONNX_INTRA_OP_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = os.path.join(model_dir, QUANTIZED_FILE if quantized else MODEL_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; run `python onnx_embedder.py export{' --quantize' if quantized else ''}` first")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // 2)
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        self.dim = self.session.get_outputs()[0].shape[-1]
+        self.name = f"{MODEL_NAME}-onnx{'-int8' if quantized else ''}"
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, batch_size: int = 64, **kwargs):
+        # Same call shape as SentenceTransformer.encode for the ways we use it
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+            hidden = self.session.run(None, feeds)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            out[start:start + len(encodings)] = pooled
+
+        return out[0] if single else out
+
+
+def export(model_dir: str = ONNX_MODEL_DIR, quantize: bool = False, cache_dir: str = None):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(HF_MODEL_ID, cache_dir=cache_dir)
+    model = AutoModel.from_pretrained(HF_MODEL_ID, cache_dir=cache_dir).eval()
+    tokenizer.save_pretrained(model_dir)
+
+    dummy = tokenizer(["export example"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    path = os.path.join(model_dir, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(dummy[name] for name in names), path,
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic, opset_version=14
+        )
+    print(f"Exported {HF_MODEL_ID} to {path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized_path = os.path.join(model_dir, QUANTIZED_FILE)
+        quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"Wrote int8 model to {quantized_path}")
+
+
+def parity(model_dir: str = ONNX_MODEL_DIR, quantized: bool = ONNX_QUANTIZED, threshold: float = PARITY_THRESHOLD, texts=None) -> bool:
+    # Cosine similarity between torch and ONNX embeddings must stay above threshold for every text
+    from sentence_transformers import SentenceTransformer
+
+    if texts is None:
+        from drug_catalog import load_catalog
+        catalog = load_catalog()
+        texts = catalog.names()[:500] if catalog is not None else []
+        texts += ["atorvastatin", "ethinyl estradiol and norgestimate", "blood pressure medicine", "ibuprofen 800 mg"]
+
+    reference = SentenceTransformer(MODEL_NAME).encode(texts, normalize_embeddings=True)
+    candidate = OnnxEmbedder(model_dir, quantized).encode(texts)
+    cosine = (reference * candidate).sum(axis=1)
+
+    worst = int(np.argmin(cosine))
+    print(f"{len(texts)} texts: min cosine {cosine.min():.5f} ({texts[worst]!r}), mean {cosine.mean():.5f}, threshold {threshold}")
+    return bool(cosine.min() >= threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and check the ONNX embedding model")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export")
+    export_cmd.add_argument("--quantize", action="store_true", help="also write a dynamic int8 model")
+    export_cmd.add_argument("--cache-dir", default=os.getenv("MODEL_CACHE_DIR"))
+    parity_cmd = sub.add_parser("parity")
+    parity_cmd.add_argument("--fp32", action="store_true", help="check model.onnx instead of the int8 model")
+    parity_cmd.add_argument("--threshold", type=float, default=PARITY_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export(quantize=args.quantize, cache_dir=args.cache_dir)
+    else:
+        ok = parity(quantized=not args.fp32 and ONNX_QUANTIZED, threshold=args.threshold)
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
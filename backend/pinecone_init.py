@@ -1,73 +1,132 @@
 from dotenv import load_dotenv
 from pinecone import Pinecone, ServerlessSpec, CloudProvider, AwsRegion, VectorType
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
+import random
+import time
 from sentence_transformers import SentenceTransformer
 import pandas as pd
-from uuid import uuid4
 from tqdm import tqdm
 
 # This script will only run once, unless the database needs to be updated or changed.
+# Re-runs are incremental: vector IDs are a hash of the row content, so only new or
+# changed rows get embedded and upserted, and rows no longer in drugs.csv are deleted.
 
 load_dotenv()
 pinecone_api = os.getenv("PINECONE_API_KEY")
 INDEX_NAME = "medmate-interactions"
 NAMESPACE = "default"
 MODEL_NAME = "all-MiniLM-L6-v2"
+DRUGS_CSV = os.getenv("DRUGS_CSV", "drugs.csv")
 
-# initialize Pinecone client
-pc = Pinecone(api_key=pinecone_api)
+ENCODE_BATCH_SIZE = 256
+UPSERT_BATCH_SIZE = 100
+DELETE_BATCH_SIZE = 1000
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+MAX_RETRIES = 5
 
-# create a new serverless index if not already created
-# just connect to the existing index by name
-index_description = pc.describe_index(name=INDEX_NAME)
-idx = pc.Index(host=index_description.host)
+METADATA_COLUMNS = {
+    "generic_name": "name_lower",
+    "full_name": "generic_name",
+    "drug_class": "drug_classes",
+    "alcohol": "alcohol",
+    "pregnancy": "pregnancy_category",
+    "csa": "csa",
+    "brand_names": "brand_names",
+    "rx_otc": "rx_otc",
+    "rating": "rating",
+}
 
 
-# load drug dataset
-df = pd.read_csv("drugs.csv").fillna("Unknown")
-model = SentenceTransformer(MODEL_NAME)
-
-# build and upsert embeddings
-vectors = []
-for _, row in df.iterrows():
-    generic_name = row["generic_name"]
-    drug_class = row["drug_classes"]
-    alcohol = row["alcohol"]
-    pregnancy = row["pregnancy_category"]
-    csa = row["csa"]
-    indications = row["indications"] if "indications" in row else "various medical conditions"
+def build_rows(df: pd.DataFrame) -> pd.DataFrame:
+    # One row per generic component, with the text to embed and a content-derived ID
+    df = df.fillna("Unknown")
+    if "indications" not in df:
+        df["indications"] = "various medical conditions"
 
     # Split combo names like "ethinyl estradiol / norgestimate"
-    components = [name.strip() for name in generic_name.split("/")]
-
-    for name in components:
-        text = (
-            f"{name} is a medication often found in the combination drug '{generic_name}'. "
-            f"It belongs to the {drug_class} class and is used to treat {indications}. "
-            f"It is categorized as {row['rx_otc']}, pregnancy category {pregnancy}, "
-            f"CSA schedule {csa}, and has alcohol interaction status '{alcohol}'."
-        )
-        embedding = model.encode(text).tolist()
-
-        metadata = {
-            "generic_name": name.lower(),
-            "full_name": generic_name,
-            "drug_class": drug_class,
-            "alcohol": alcohol,
-            "pregnancy": pregnancy,
-            "csa": csa,
-            "brand_names": row["brand_names"],
-            "rx_otc": row["rx_otc"],
-            "rating": row["rating"]
-        }
-
-
-        vectors.append((str(uuid4()), embedding, metadata))
-
-# Upload in batches to avoid timeouts
-batch_size = 100
-for i in tqdm(range(0, len(vectors), batch_size), desc="Uploading to Pinecone"):
-    batch = vectors[i:i+batch_size]
-    idx.upsert(vectors=batch, namespace="default")
-
-print("Upload complete.")
+    df = df.assign(name=df["generic_name"].str.split("/")).explode("name", ignore_index=True)
+    df["name"] = df["name"].str.strip()
+    df["name_lower"] = df["name"].str.lower()
+
+    s = lambda col: df[col].astype(str)
+    df["text"] = (
+        s("name") + " is a medication often found in the combination drug '" + s("generic_name") + "'. "
+        + "It belongs to the " + s("drug_classes") + " class and is used to treat " + s("indications") + ". "
+        + "It is categorized as " + s("rx_otc") + ", pregnancy category " + s("pregnancy_category") + ", "
+        + "CSA schedule " + s("csa") + ", and has alcohol interaction status '" + s("alcohol") + "'."
+    )
+
+    # Hash the embedded text plus every metadata value, so any change yields a new ID
+    fingerprint = df["text"]
+    for col in METADATA_COLUMNS.values():
+        fingerprint = fingerprint + "\x1f" + s(col)
+    df["id"] = [hashlib.sha1(f.encode("utf-8")).hexdigest() for f in fingerprint]
+
+    return df.drop_duplicates("id", ignore_index=True)
+
+
+def row_metadata(row) -> dict:
+    return {key: row[col] for key, col in METADATA_COLUMNS.items()}
+
+
+def with_retries(fn, *args, **kwargs):
+    # Exponential backoff with jitter for throttled or flaky upserts/deletes
+    for attempt in range(MAX_RETRIES):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            delay = min(30, 2 ** attempt) * (0.5 + random.random())
+            print(f"Retrying after error ({e}), attempt {attempt + 1}/{MAX_RETRIES}")
+            time.sleep(delay)
+
+
+def existing_ids(idx) -> set:
+    ids = set()
+    for page in idx.list(namespace=NAMESPACE):
+        ids.update(page)
+    return ids
+
+
+def main():
+    # initialize Pinecone client
+    pc = Pinecone(api_key=pinecone_api)
+
+    # create a new serverless index if not already created
+    # just connect to the existing index by name
+    index_description = pc.describe_index(name=INDEX_NAME)
+    idx = pc.Index(host=index_description.host, pool_threads=UPLOAD_WORKERS)
+
+    # load drug dataset
+    rows = build_rows(pd.read_csv(DRUGS_CSV))
+    current = existing_ids(idx)
+
+    new_rows = rows[~rows["id"].isin(current)]
+    stale_ids = sorted(current - set(rows["id"]))
+    print(f"{len(rows)} catalog rows: {len(new_rows)} to embed and upsert, {len(stale_ids)} to delete.")
+
+    if len(new_rows):
+        model = SentenceTransformer(MODEL_NAME)
+        embeddings = model.encode(new_rows["text"].tolist(), batch_size=ENCODE_BATCH_SIZE, show_progress_bar=True)
+        vectors = [
+            (row["id"], embedding.tolist(), row_metadata(row))
+            for row, embedding in zip(new_rows.to_dict("records"), embeddings)
+        ]
+
+        # Upload batches in parallel to avoid timeouts
+        batches = [vectors[i:i + UPSERT_BATCH_SIZE] for i in range(0, len(vectors), UPSERT_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+            upload = lambda batch: with_retries(idx.upsert, vectors=batch, namespace=NAMESPACE)
+            list(tqdm(pool.map(upload, batches), total=len(batches), desc="Uploading to Pinecone"))
+
+    for i in tqdm(range(0, len(stale_ids), DELETE_BATCH_SIZE), desc="Deleting stale vectors"):
+        with_retries(idx.delete, ids=stale_ids[i:i + DELETE_BATCH_SIZE], namespace=NAMESPACE)
+
+    print("Upload complete.")
+
+
+if __name__ == "__main__":
+    main()
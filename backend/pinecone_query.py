@@ -1,7 +1,19 @@
+import argparse
+import asyncio
+import contextvars
+import gc
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
+
+from autocomplete import NameIndex
+from drug_catalog import load_catalog
+from embedding_cache import EmbeddingCache
+from interactions import INTERACTIONS_FILE, load_or_build
+from singleflight import SingleFlight
+import metrics
+from vector_store import LocalStore, PineconeStore
 
 # Load environment variables
 load_dotenv()
@@ -9,122 +21,240 @@ PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 INDEX_NAME = "medmate-interactions"
 NAMESPACE = "default"
 MODEL_NAME = "all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+PINECONE_QUERY_WORKERS = int(os.getenv("PINECONE_QUERY_WORKERS", "8"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "embed_cache")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+EMBED_CACHE_PREWARM = os.getenv("EMBED_CACHE_PREWARM", "1") == "1"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone") # "pinecone" or "local"
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_index")
+LOCAL_INDEX_MMAP = os.getenv("LOCAL_INDEX_MMAP", "1") == "1"
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR") or None # pre-downloaded weights skip the Hugging Face fetch
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch") # "torch" (SentenceTransformer) or "onnx" (ONNX Runtime)
 
 shared_state = {}
 
-def init_resources():
+# Pinecone queries are network-bound, so a small thread pool lets us fan them out.
+# Encoding is CPU-bound (torch), so it gets its own, smaller pool to keep it bounded.
+query_pool = ThreadPoolExecutor(max_workers=PINECONE_QUERY_WORKERS, thread_name_prefix="pinecone-query")
+embed_pool = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+# Concurrent requests for the same (name, top_k) share one encode + vector query
+semantic_flights = SingleFlight("semantic_query")
 
-    # Load embedding model once
-    model = SentenceTransformer(MODEL_NAME)
+def init_resources(progress=print):
+    # Slow (torch import, weights, network), so the API runs this in the background at startup.
+    # progress(stage) is called before each step so readiness checks can report where we are.
+    # Anything preload_shared_resources() already loaded before a fork is reused as-is.
 
-    # Connect to Pinecone
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-    index_info = pc.describe_index(name=INDEX_NAME)
-    index = pc.Index(host=index_info.host)
-    
-    shared_state["model"] = model
-    shared_state["index"] = index
+    # Load embedding model once; the dummy encode pays torch's first-call cost here, not on a request
+    if "model" not in shared_state:
+        progress("loading_model")
+        shared_state["model"], shared_state["model_key"] = load_embedding_model(EMBED_BACKEND)
+    model, model_key = shared_state["model"], shared_state["model_key"]
+    model.encode(["warmup"])
+
+    load_catalog_resources(progress)
+    catalog = shared_state["catalog"]
+    if "index" not in shared_state:
+        progress("opening_vector_store")
+        shared_state["index"] = open_vector_store(VECTOR_BACKEND, catalog)
+
+    # Query embeddings are cached in memory and on disk; prewarm with every catalog name
+    cache = EmbeddingCache(model_key, model.get_sentence_embedding_dimension(), EMBED_CACHE_DIR or None, EMBED_CACHE_SIZE)
+    if EMBED_CACHE_PREWARM and catalog is not None:
+        progress("prewarming_embedding_cache")
+        added = cache.prewarm(catalog.names(), model_encode)
+        print(f"[EmbedCache] {len(cache)} cached embeddings ({added} newly encoded)")
+    shared_state["embed_cache"] = cache
+
+def load_catalog_resources(progress=print):
+    if "catalog" in shared_state:
+        return
+    progress("loading_catalog")
+    shared_state["catalog"] = catalog = load_catalog()
+    if catalog is not None:
+        shared_state["autocomplete"] = NameIndex.build(catalog)
+    progress("loading_interactions")
+    shared_state["interactions"] = load_or_build(catalog, INTERACTIONS_FILE)
+
+def preload_shared_resources(progress=print):
+    # Called in the gunicorn master (see gunicorn.conf.py) before the workers fork. Loads the
+    # read-only parts once: torch weights, catalog, interaction table, name index and the local
+    # embedding matrix; the workers then share those pages copy-on-write. Nothing here may start
+    # threads or open sockets, so the first encode, the ONNX session (it owns a thread pool),
+    # the Pinecone client and the embedding cache are left to init_resources() in each worker.
+    # For the same reason the local index is not built here (encoding starts torch's thread pool);
+    # without a prebuilt one every worker would build its own, so refuse to start instead.
+    local_index = os.path.join(LOCAL_INDEX_DIR, "embeddings.npy")
+    if VECTOR_BACKEND == "local" and not os.path.exists(local_index):
+        raise RuntimeError(
+            f"No local index in {LOCAL_INDEX_DIR}; build it first with `python pinecone_query.py build-index` "
+            "(or start with PRELOAD_MODELS=0)"
+        )
+    if EMBED_BACKEND == "torch":
+        progress("loading_model")
+        shared_state["model"], shared_state["model_key"] = load_embedding_model(EMBED_BACKEND)
+    load_catalog_resources(progress)
+    if VECTOR_BACKEND == "local":
+        shared_state["index"] = LocalStore.load(LOCAL_INDEX_DIR, mmap=LOCAL_INDEX_MMAP)
+
+    # Move everything loaded so far out of the collector's reach: a collection in a worker would
+    # otherwise write to these objects' headers and un-share their pages
+    gc.collect()
+    gc.freeze()
+    print(f"[Preload] {gc.get_freeze_count()} objects shared with workers")
+
+def load_embedding_model(backend: str):
+    # Returns the model and the name its embeddings are cached under
+    if backend == "onnx":
+        from onnx_embedder import OnnxEmbedder
+        model = OnnxEmbedder()
+        return model, model.name
+
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(MODEL_NAME, cache_folder=MODEL_CACHE_DIR), MODEL_NAME
+
+    raise ValueError(f"Unknown EMBED_BACKEND: {backend}")
+
+def open_vector_store(backend: str, catalog):
+    if backend == "local":
+        if not os.path.exists(os.path.join(LOCAL_INDEX_DIR, "embeddings.npy")):
+            if catalog is None:
+                raise RuntimeError(f"VECTOR_BACKEND=local needs drugs.csv or a prebuilt index in {LOCAL_INDEX_DIR}")
+            print(f"[LocalStore] Building local index for {len(catalog)} rows in {LOCAL_INDEX_DIR}")
+            LocalStore.build(catalog, model_encode, LOCAL_INDEX_DIR)
+        return LocalStore.load(LOCAL_INDEX_DIR, mmap=LOCAL_INDEX_MMAP)
+
+    if backend == "pinecone":
+        # Connect to Pinecone, sizing the client's connection pool to match query_pool
+        from pinecone import Pinecone
+        pc = Pinecone(api_key=PINECONE_API_KEY)
+        index_info = pc.describe_index(name=INDEX_NAME)
+        index = pc.Index(host=index_info.host, pool_threads=PINECONE_QUERY_WORKERS)
+        return PineconeStore(index, NAMESPACE)
+
+    raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
     
 def clear_resources():
     shared_state.clear()
 
-def retrieve_drugs(query_text:str, top_k:int = 10):
-    model = shared_state["model"]
-    index = shared_state["index"]
-    namespace = "default" #trying to make it faster with local variable#
-    
-    #exact match first
-    exact = index.query(
-        vector=[0.0] * 384, #384 is the vector size
-        filter={"generic_name": {"$eq": query_text.lower()}}, 
-        top_k=1,
-        include_metadata=True,
-        namespace=namespace
-    ).get("matches", [])
-    
-    if len(exact) > 0:
-        return {"mode": "exact", "results": format_results(exact)}
-    
-    # Semantic fallback
-    embedding = model.encode(query_text.lower()).tolist()
-    semantic = index.query(
-        vector = embedding, 
-        top_k = 10,
-        include_metadata = True,
-        namespace = namespace
-    ).get("matches", [])
-    
-    return {"mode": "semantic", "results": format_results(semantic)}
-
-# Send medication information to gemini
-def get_medication_definitions_for_gemini(med_names: list[str], top_k: int = 1):
-    model = shared_state["model"]
-    index = shared_state["index"]
-    namespace = "default"
-
-    meds_with_defs = []
-
-    for name in med_names:
-        # Semantic search
-        embedding = model.encode(name.lower()).tolist()
-        res = index.query(
-            vector=embedding,
-            top_k=top_k,
-            include_metadata=True,
-            namespace=namespace
+def model_encode(texts: list[str]):
+    metrics.embedded_texts.inc(len(texts))
+    with metrics.stage("embed", texts=len(texts)):
+        return shared_state["model"].encode(texts, batch_size=EMBED_BATCH_SIZE)
+
+def encode(texts: list[str]):
+    cache = shared_state.get("embed_cache")
+    if cache is None:
+        return model_encode(texts)
+    return cache.encode(texts, model_encode)
+
+def semantic_query(embedding, top_k: int = 10):
+    with metrics.stage("vector_query", top_k=top_k):
+        return shared_state["index"].query(embedding, top_k=top_k)
+
+async def run_in(pool, fn, *args):
+    # Carry the caller's context over so stage timings land on the right request
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(pool, ctx.run, fn, *args)
+
+# Resolve a whole list in one go: exact hits first, then one batched encode for the misses
+# and their vector searches in parallel. Returns one result per input name, in order.
+async def retrieve_drugs_bulk_async(names: list[str], top_k: int = 10):
+    catalog = shared_state.get("catalog")
+    store = shared_state["index"]
+    keys = list(dict.fromkeys(name.strip().lower() for name in names))
+
+    if catalog is not None:
+        exact = [exact_matches(catalog, key) for key in keys]
+    else:
+        exact = await asyncio.gather(*(run_in(query_pool, index_exact_matches, store, key) for key in keys))
+
+    resolved = {key: {"mode": "exact", "results": format_results(found)} for key, found in zip(keys, exact) if found}
+    misses = [key for key in keys if key not in resolved]
+
+    if misses:
+        semantic = await semantic_lookup_async(misses, top_k)
+        for key in misses:
+            resolved[key] = {"mode": "semantic", "results": format_results(semantic[key])}
+
+    return [resolved[name.strip().lower()] for name in names]
+
+# Typeahead suggestions from the in-memory name index; None when there is no catalog to build it from
+def suggest_names(prefix: str, limit: int = 10):
+    index = shared_state.get("autocomplete")
+    if index is None:
+        return None
+    with metrics.stage("autocomplete"):
+        return index.suggest(prefix, limit)
+
+# Deterministic conflict flags for a regimen from the precomputed table; None when it isn't loaded
+def check_interactions(med_names: list[str]):
+    index = shared_state.get("interactions")
+    if index is None:
+        return None
+    with metrics.stage("interactions"):
+        return index.check(med_names)
+
+async def semantic_lookup_async(keys: list[str], top_k: int):
+    # Vector matches per (lowercased) key. Keys another request is already looking up are joined;
+    # the rest are encoded in one batch and queried in parallel, in a task of their own.
+    futures = {}
+    mine = []
+    for key in dict.fromkeys(keys):
+        futures[key], leader = semantic_flights.begin((key, top_k))
+        if leader:
+            mine.append(key)
+    if mine:
+        semantic_flights.spawn(_semantic_batch(mine, top_k))
+    return {key: await asyncio.shield(future) for key, future in futures.items()}
+
+async def _semantic_batch(keys: list[str], top_k: int):
+    try:
+        embeddings = await run_in(embed_pool, encode, keys)
+        matches = await asyncio.gather(*(run_in(query_pool, semantic_query, e, top_k) for e in embeddings))
+    except BaseException as e:
+        for key in keys:
+            semantic_flights.finish((key, top_k), error=e)
+        if not isinstance(e, Exception):
+            raise
+        return
+    for key, found in zip(keys, matches):
+        semantic_flights.finish((key, top_k), result=found)
+
+def exact_matches(catalog, query_text: str, top_k: int = 1):
+    # Score is 0.0 to match what the old zero-vector Pinecone query returned
+    return [
+        {"score": 0.0, "metadata": catalog.metadata(i)}
+        for i in catalog.lookup(query_text)[:top_k]
+    ]
+
+def index_exact_matches(store, query_text: str):
+    with metrics.stage("vector_query", top_k=1):
+        return store.query(
+            [0.0] * 384, #384 is the vector size
+            top_k=1,
+            filter={"generic_name": {"$eq": query_text.lower()}}
         )
 
-        if res.get("matches"):
-            metadata = res["matches"][0]["metadata"]
-            generic_name = metadata.get("generic_name", name)
-            brand_names = metadata.get("brand_names", "")
-            drug_class = metadata.get("drug_class", "Unknown class")
-            pregnancy = metadata.get("pregnancy", "N")
-            csa = metadata.get("csa", "U")
-            alcohol = metadata.get("alcohol", "")
-            rx_otc = metadata.get("rx_otc", "Unknown")
-            rating = metadata.get("rating", "Not rated")
-
-            # Pregnancy description
-            pregnancy_risk = {
-                "A": "No risk in first trimester.",
-                "B": "No human risk, animal studies show none.",
-                "C": "Animal risk shown; use only if benefits outweigh risks.",
-                "D": "Positive evidence of fetal risk; benefits may still justify use.",
-                "X": "High risk of fetal abnormalities; should not be used.",
-                "N": "Not classified."
-            }.get(pregnancy, "Unknown risk")
-
-            # CSA description
-            csa_class = {
-                "1": "Schedule I – High abuse risk, no accepted medical use.",
-                "2": "Schedule II – High abuse risk, but accepted medical use.",
-                "3": "Schedule III – Moderate abuse risk, accepted use.",
-                "4": "Schedule IV – Lower abuse risk.",
-                "5": "Schedule V – Lowest abuse risk.",
-                "N": "Not a controlled substance.",
-                "M": "Multiple schedules apply.",
-                "U": "Unknown CSA schedule."
-            }.get(csa, "Unlisted.")
-
-            description = f"""{generic_name} belongs to the drug class {drug_class}. 
-It is available under the following brand names: {brand_names}. 
-This medication is classified as {rx_otc}, with a user-reported effectiveness rating of {rating}/10. 
-Pregnancy category: {pregnancy} — {pregnancy_risk} 
-CSA Schedule: {csa} — {csa_class} 
-Alcohol Interaction Warning: {alcohol}"""
-
-        else:
-            description = "No definition available."
-
-        #Add to list for semantic
-        meds_with_defs.append({
-            "name": name,
-            "definition": description.strip()
-        })
-
-    return meds_with_defs
+# (name, metadata of the best match or None) per distinct name, for prompt_builder
+async def get_medication_facts_async(med_names: list[str]):
+    unique_names, matches = await match_medications_async(med_names, 1)
+    return [(name, found[0]["metadata"] if found else None) for name, found in zip(unique_names, matches)]
+
+async def match_medications_async(med_names: list[str], top_k: int = 1):
+    unique_names = unique_med_names(med_names)
+    if not unique_names:
+        return [], []
 
+    semantic = await semantic_lookup_async([name.lower() for name in unique_names], top_k)
+    return unique_names, [semantic[name.lower()] for name in unique_names]
+
+def unique_med_names(med_names: list[str]) -> list[str]:
+    # Collapse duplicate names, keeping the order they first appear in
+    return list(dict.fromkeys(name.strip() for name in med_names if name.strip()))
 
 # Helper function
 def format_results(matches):
@@ -140,8 +270,22 @@ def format_results(matches):
         for match in matches
     ]
 
-# # Test entry point
-# if __name__ == "__main__":
-#     results = retrieve_drugs("atorvastatin", model, index)
-#     for r in results:
-#         print(r)
+def build_local_index():
+    catalog = load_catalog()
+    if catalog is None:
+        sys.exit(1)
+    shared_state["model"], _ = load_embedding_model(EMBED_BACKEND)
+    store = LocalStore.build(catalog, model_encode, LOCAL_INDEX_DIR)
+    print(f"[LocalStore] Wrote {len(store)} rows to {LOCAL_INDEX_DIR}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drug search resources")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build-index", help=f"embed drugs.csv into the local index ({LOCAL_INDEX_DIR})")
+    parser.parse_args()
+    build_local_index()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+from dotenv import load_dotenv
+
+import metrics
+
+# Renders the medication facts Gemini sees as a compact table instead of a prose paragraph per drug.
+# Class names and code meanings are listed once, and the whole section is fitted into a token
+# budget by dropping the least useful fields first (rating, brands, Rx/OTC, code legend, ...).
+
+load_dotenv()
+# Upper bound for the user prompt (medications + interactions + profile); the system prompt is extra
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))
+# Bump whenever render_medications' output changes; it is part of the summary cache key
+FORMAT_VERSION = 1
+CHARS_PER_TOKEN = 4 # close enough for English text with Gemini's tokenizer
+MAX_BRANDS = 3
+
+PREGNANCY_RISK = {
+    "A": "No risk in first trimester.",
+    "B": "No human risk, animal studies show none.",
+    "C": "Animal risk shown; use only if benefits outweigh risks.",
+    "D": "Positive evidence of fetal risk; benefits may still justify use.",
+    "X": "High risk of fetal abnormalities; should not be used.",
+    "N": "Not classified."
+}
+
+CSA_SCHEDULE = {
+    "1": "Schedule I – High abuse risk, no accepted medical use.",
+    "2": "Schedule II – High abuse risk, but accepted medical use.",
+    "3": "Schedule III – Moderate abuse risk, accepted use.",
+    "4": "Schedule IV – Lower abuse risk.",
+    "5": "Schedule V – Lowest abuse risk.",
+    "N": "Not a controlled substance.",
+    "M": "Multiple schedules apply.",
+    "U": "Unknown CSA schedule."
+}
+
+# Fields dropped in this order until the section fits. Class and the pregnancy/CSA/alcohol codes
+# stay until the end: "short_classes" shortens class names, and "names_only" keeps just the names.
+TRIM_LEVELS = ["full", "no_rating", "no_brands", "no_rx_otc", "no_legend", "short_classes", "names_only"]
+SHORT_CLASS_CHARS = 32
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def _value(metadata: dict, field: str) -> str:
+    value = str(metadata.get(field, "") or "").strip()
+    return "" if value in ("Unknown", "nan") else value
+
+def render_medications(facts: list[tuple], level: int = 0) -> str:
+    # facts: (name as given, catalog/Pinecone metadata or None) per medication
+    drop = set(TRIM_LEVELS[1:level + 1])
+    names_only = "names_only" in drop
+
+    classes = {}
+    rows = []
+    pregnancy_codes, csa_codes = set(), set()
+    for name, metadata in facts:
+        if metadata is None:
+            rows.append(f"- {name} | not in catalog")
+            continue
+        if names_only:
+            rows.append(f"- {name}")
+            continue
+
+        drug_class = _value(metadata, "drug_class")
+        class_id = f"C{classes.setdefault(drug_class, len(classes) + 1)}" if drug_class else "-"
+        pregnancy = _value(metadata, "pregnancy") or "-"
+        csa = _value(metadata, "csa") or "-"
+        pregnancy_codes.add(pregnancy)
+        csa_codes.add(csa)
+
+        generic_name = _value(metadata, "generic_name")
+        label = name if not generic_name or generic_name.lower() == name.lower() else f"{name} ({generic_name})"
+        cells = [label, class_id, pregnancy, csa, "X" if _value(metadata, "alcohol") == "X" else "-"]
+        if "no_rx_otc" not in drop:
+            cells.append(_value(metadata, "rx_otc") or "-")
+        if "no_brands" not in drop:
+            brands = [b.strip() for b in _value(metadata, "brand_names").split(",") if b.strip()]
+            cells.append(", ".join(brands[:MAX_BRANDS]) or "-")
+        if "no_rating" not in drop:
+            cells.append(_value(metadata, "rating") or "-")
+        rows.append("- " + " | ".join(cells))
+
+    if names_only:
+        return "\n".join(rows)
+
+    columns = ["name", "class", "pregnancy", "csa", "alcohol"]
+    columns += [c for c, field in [("rx/otc", "no_rx_otc"), ("brands", "no_brands"), ("rating/10", "no_rating")] if field not in drop]
+    lines = [f"Columns: {' | '.join(columns)}", *rows]
+
+    if classes:
+        shorten = "short_classes" in drop
+        lines.append("Classes:")
+        lines += [
+            f"C{i} {drug_class[:SHORT_CLASS_CHARS] if shorten else drug_class}"
+            for drug_class, i in classes.items()
+        ]
+    if "no_legend" not in drop:
+        legend = [f"pregnancy {code}: {PREGNANCY_RISK[code]}" for code in sorted(pregnancy_codes) if code in PREGNANCY_RISK]
+        legend += [f"csa {code}: {CSA_SCHEDULE[code]}" for code in sorted(csa_codes) if code in CSA_SCHEDULE]
+        if legend:
+            lines.append("Codes: " + "; ".join(legend))
+    return "\n".join(lines)
+
+def fit_medications(facts: list[tuple], reserved: str = "", budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    # reserved is the rest of the prompt (template, profile, interactions), which is never trimmed
+    remaining = budget - estimate_tokens(reserved)
+    for level, name in enumerate(TRIM_LEVELS):
+        text = render_medications(facts, level)
+        if estimate_tokens(text) <= remaining:
+            break
+    else:
+        print(f"[Prompt] {len(facts)} medications need ~{estimate_tokens(text)} tokens, over the {remaining} left in the budget")
+
+    metrics.prompt_trim_levels.inc(level=name)
+    metrics.prompt_tokens_estimated.observe(estimate_tokens(text) + estimate_tokens(reserved))
+    return text
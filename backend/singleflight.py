@@ -0,0 +1,99 @@
+import asyncio
+
+import metrics
+
+# Request coalescing: while a call for a key is in flight, identical calls wait for its result
+# instead of starting their own. Two forms: begin()/finish() around work the leader runs itself
+# (pinecone_query batches several keys into one call), and stream() for shared async iteration.
+# The work runs in its own task (spawn), so a caller that disconnects doesn't cancel it for
+# everyone else. Keys are released as soon as the call finishes, so errors reach every waiter
+# but are never reused by later calls.
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = {}   # key -> Future
+        self.streams = {} # key -> SharedStream
+        self.tasks = set() # strong refs; the event loop only keeps weak ones
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def begin(self, key):
+        # (future, True) if the caller should do the work and call finish(), else (future, False)
+        future = self.calls.get(key)
+        if future is not None:
+            metrics.coalesced_calls.inc(flight=self.name)
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        # Mark the exception as retrieved even if every waiter has gone away
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.calls[key] = future
+        return future, True
+
+    def finish(self, key, result=None, error: BaseException = None):
+        future = self.calls.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error if isinstance(error, Exception) else RuntimeError(f"{self.name} call was cancelled"))
+
+    def stream(self, key, make_source):
+        # Shared async iteration: make_source() is only called when nothing is in flight for key
+        shared = self.streams.get(key)
+        if shared is not None:
+            metrics.coalesced_calls.inc(flight=self.name)
+            return shared
+        shared = self.streams[key] = SharedStream()
+        task = self.spawn(shared.run(make_source()))
+        task.add_done_callback(lambda _: self._release(key, shared))
+        return shared
+
+    def _release(self, key, shared):
+        if self.streams.get(key) is shared:
+            del self.streams[key]
+
+
+class SharedStream:
+    # Fans one async generator out to any number of readers; late joiners replay from the start
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def run(self, source):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        except BaseException:
+            self.error = RuntimeError("shared stream was cancelled")
+            raise
+        finally:
+            self.finished = True
+            self._notify()
+
+    async def read(self):
+        i = 0
+        while True:
+            while i < len(self.items):
+                yield self.items[i]
+                i += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self.changed.wait()
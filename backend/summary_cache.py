@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+# Two-tier cache for Gemini medication summaries:
+#   1. in-process LRU (per worker)
+#   2. MongoDB collection shared by every worker, expired by a TTL index
+# Keys are derived from the regimen and profile, so patients on the same regimen share entries.
+
+load_dotenv()
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "512"))
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def _norm(text) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def summary_key(medications: list[str], profile: dict, version: str) -> str:
+    # Order and case of the medication list don't change the summary, so canonicalize them
+    canonical = {
+        "medications": sorted({_norm(m) for m in medications if _norm(m)}),
+        "profile": {
+            "age": profile.get("age"),
+            "conditions": sorted({_norm(c) for c in profile.get("conditions", [])}),
+            "allergies": sorted({_norm(a) for a in profile.get("allergies", [])}),
+        },
+        "version": version,
+    }
+    blob = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    def __init__(self, collection, version: str, max_items: int = SUMMARY_CACHE_SIZE, ttl: int = SUMMARY_CACHE_TTL):
+        self.collection = collection
+        self.version = version
+        self.max_items = max_items
+        self.ttl = ttl
+        self.lru = OrderedDict()
+
+    def key(self, medications: list[str], profile: dict) -> str:
+        return summary_key(medications, profile, self.version)
+
+    def _remember(self, key: str, html: str):
+        self.lru[key] = (time.monotonic() + self.ttl, html)
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_items:
+            self.lru.popitem(last=False)
+
+    async def get(self, key: str):
+        hit = self.lru.get(key)
+        if hit is not None:
+            expires, html = hit
+            if expires > time.monotonic():
+                self.lru.move_to_end(key)
+                return html
+            del self.lru[key]
+
+        if self.collection is None:
+            return None
+        try:
+            doc = await self.collection.find_one({"_id": key, "version": self.version})
+        except Exception as e:
+            # A cache outage should never fail the request; we just regenerate
+            print(f"[SummaryCache] lookup failed: {e}")
+            return None
+        if doc is None:
+            return None
+        self._remember(key, doc["html"])
+        return doc["html"]
+
+    async def set(self, key: str, html: str):
+        self._remember(key, html)
+        if self.collection is None:
+            return
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {"html": html, "version": self.version, "created_at": datetime.now(timezone.utc)},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"[SummaryCache] store failed: {e}")
+
+    async def ensure_indexes(self):
+        # MongoDB drops documents once created_at is older than the TTL
+        if self.collection is None:
+            return
+        try:
+            await self.collection.create_index("created_at", expireAfterSeconds=self.ttl)
+        except Exception as e:
+            print(f"[SummaryCache] could not create TTL index: {e}")
@@ -0,0 +1,126 @@
+import json
+import os
+
+import numpy as np
+
+# Vector stores behind the drug lookups in pinecone_query. Both return Pinecone-shaped matches:
+# [{"id": ..., "score": ..., "metadata": {...}}, ...]
+
+
+class PineconeStore:
+    def __init__(self, index, namespace: str):
+        self.index = index
+        self.namespace = namespace
+
+    def query(self, vector, top_k: int = 10, filter: dict = None):
+        return self.index.query(
+            vector=list(map(float, vector)),
+            filter=filter,
+            top_k=top_k,
+            include_metadata=True,
+            namespace=self.namespace
+        ).get("matches", [])
+
+
+class LocalStore:
+    # Brute-force cosine search over an in-process (optionally memory-mapped) float32 matrix.
+    # The catalog is a few thousand rows, so one mat-vec beats a network round trip.
+    def __init__(self, embeddings, ids: list[str], metadata: list[dict]):
+        self.embeddings = embeddings
+        self.ids = ids
+        self.metadata = metadata
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r" if mmap else None)
+        with open(os.path.join(path, "metadata.json"), encoding="utf-8") as f:
+            rows = json.load(f)
+        return cls(embeddings, rows["ids"], rows["metadata"])
+
+    @classmethod
+    def build(cls, catalog, encode_fn, path: str = None, batch_size: int = 256):
+        texts = [catalog.document_text(i) for i in range(len(catalog))]
+        vectors = np.concatenate([
+            np.asarray(encode_fn(texts[i:i + batch_size]), dtype=np.float32)
+            for i in range(0, len(texts), batch_size)
+        ]) if texts else np.empty((0, 0), np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        ids = [str(i) for i in range(len(texts))]
+        metadata = [catalog.metadata(i) for i in range(len(texts))]
+        if path:
+            # Several workers may build at once: each writes its own temp files and renames them
+            # into place, metadata first, since an existing embeddings.npy marks the index as built
+            os.makedirs(path, exist_ok=True)
+            tmp = f".{os.getpid()}.tmp"
+            metadata_path = os.path.join(path, "metadata.json")
+            with open(metadata_path + tmp, "w", encoding="utf-8") as f:
+                json.dump({"ids": ids, "metadata": metadata}, f)
+            os.replace(metadata_path + tmp, metadata_path)
+            embeddings_path = os.path.join(path, "embeddings.npy")
+            with open(embeddings_path + tmp, "wb") as f:
+                np.save(f, vectors)
+            os.replace(embeddings_path + tmp, embeddings_path)
+        return cls(vectors, ids, metadata)
+
+    def column(self, field: str):
+        # Metadata columns are materialized the first time a filter uses them
+        col = self.columns.get(field)
+        if col is None:
+            col = np.array([m.get(field) for m in self.metadata], dtype=object)
+            self.columns[field] = col
+        return col
+
+    def filter_mask(self, filter: dict):
+        # Supports the subset of Pinecone's filter language we use: equality, $eq/$ne/$in/$nin, $and
+        mask = np.ones(len(self.ids), dtype=bool)
+        for field, cond in filter.items():
+            if field == "$and":
+                for sub in cond:
+                    mask &= self.filter_mask(sub)
+                continue
+            col = self.column(field)
+            if not isinstance(cond, dict):
+                cond = {"$eq": cond}
+            for op, value in cond.items():
+                if op == "$eq":
+                    mask &= col == value
+                elif op == "$ne":
+                    mask &= col != value
+                elif op == "$in":
+                    mask &= np.isin(col, list(value))
+                elif op == "$nin":
+                    mask &= ~np.isin(col, list(value))
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+        return mask
+
+    def query(self, vector, top_k: int = 10, filter: dict = None):
+        if not len(self.ids):
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = self.embeddings @ (query / norm if norm else query)
+
+        if filter:
+            mask = self.filter_mask(filter)
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+            scores = scores[candidates]
+        else:
+            candidates = None
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = candidates[top] if candidates is not None else top
+
+        return [
+            {"id": self.ids[r], "score": float(scores[t]), "metadata": self.metadata[r]}
+            for r, t in zip(rows, top)
+        ]